@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modulos que no deben cargarse solo por importar el pipeline
+HEAVY_MODULES = ('torch', 'transformers', 'tensorflow', 'spacy')
+
+# Se ejecuta en un interprete nuevo para medir el import en frio. Las conexiones de red fallan,
+# asi que una descarga al importar (como el antiguo nltk.download) rompe el benchmark.
+PROBE = """
+import json, socket, sys, time
+def _no_network(*args, **kwargs):
+    raise OSError('network access during import')
+socket.socket.connect = _no_network
+socket.create_connection = _no_network
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def measure_import(module, repeat=5):
+    """Tiempos de import de module en `repeat` interpretes nuevos y modulos pesados que arrastra"""
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                             cwd=BASE_DIR, capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(f"import {module} ha fallado:\n{out.stderr}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    return times, heavy
+
+
+def slowest_imports(module, top=15):
+    """Modulos con mayor tiempo acumulado segun python -X importtime"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=BASE_DIR, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import-time benchmark for the AttentionRank pipeline')
+    parser.add_argument('--modules', default='main,src.attentionrank.attentions,src.attentionrank.eval',
+                        help='Comma separated modules to import')
+    parser.add_argument('--repeat', default=5, type=int, help='Fresh interpreters per module')
+    parser.add_argument('--budget', default=None, type=float,
+                        help='Fail if the median import time of a module exceeds these seconds')
+    parser.add_argument('--top', default=10, type=int, help='Slowest imports to list per module')
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules.split(','):
+        times, heavy = measure_import(module, args.repeat)
+        median = sorted(times)[len(times) // 2]
+        print(f"{module}: median {median * 1000:.1f} ms, min {min(times) * 1000:.1f} ms ({args.repeat} runs)")
+        for cumulative, name in slowest_imports(module, args.top):
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+        if heavy:
+            print(f"    heavy modules loaded at import: {', '.join(heavy)}")
+            failed = True
+        if args.budget is not None and median > args.budget:
+            print(f"    over budget ({args.budget} s)")
+            failed = True
+
+    sys.exit(1 if failed else 0)
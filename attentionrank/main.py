@@ -1,8 +1,4 @@
-from transformers import BertTokenizer, AutoModel, AutoTokenizer
-
-from src.attentionrank.attentions import step_5, step6,step7,step8,step9,step10,update_paths
-from src.attentionrank.CandidatesGenerator import CandidatesGenerator
-from src.attentionrank.ModelEmbedding import ModelEmbedding
+from src.attentionrank.attentions import step_5, step6,step7,step8,step9,step10,update_paths, make_pool
 
 from src.attentionrank.preprocessing import preprocessing_module, update_paths_preprocessing
 from src.attentionrank.eval import evaluate_results, generate_results, update_paths_eval
@@ -11,8 +7,8 @@ import sys
 import argparse
 
 
-if __name__ == '__main__':
-
+def build_parser():
+    """Opciones de la linea de comandos (tambien las usa server.py)"""
     parser = argparse.ArgumentParser()
     #parser.add_argument("--dataset_dir",
     #                    default=None,
@@ -58,54 +54,103 @@ if __name__ == '__main__':
                         type=str,
                         help="Ultimo paso a ejecutar (step5 o all)")
 
-    #parser.add_argument("--local_rank",
-    #                    default=-1,
-    #                    type=int,
-    #                    help="local_rank for distributed training on gpus")
+    parser.add_argument("--batch_size",
+                        default=1,
+                        type=int,
+                        help="Frases por pasada del modelo en los steps 1-4 (1 = frase a frase)")
 
-    #parser.add_argument("--no_cuda",
-    #                    action="store_true",
-    #                    help="Whether not to use CUDA when available")
-    args = parser.parse_args()
+    parser.add_argument("--max_batch_tokens",
+                        default=8192,
+                        type=int,
+                        help="Maximo de tokens con padding (frases x longitud) por lote en los steps 1-4")
 
-    #start = time.time()
-    #log = Logger(args.log_dir + args.dataset_name + '.kpe.' + args.doc_embed_mode + '.log')
+    parser.add_argument("--batch_docs",
+                        default=8,
+                        type=int,
+                        help="Documentos cuyas frases se agrupan juntas en lotes en los steps 1-4")
 
+    parser.add_argument("--attn_storage",
+                        default="layers",
+                        choices=["full", "layers", "colsum"],
+                        type=str,
+                        help="Atenciones guardadas en los steps 1-4: todas las capas, solo --attn_layers o su suma por columnas")
 
+    parser.add_argument("--attn_layers",
+                        default="-1",
+                        type=str,
+                        help="Capas a guardar separadas por comas (por defecto la ultima, la que usa el step 5)")
 
+    parser.add_argument("--attn_dtype",
+                        default="float32",
+                        choices=["float32", "float16"],
+                        type=str,
+                        help="Precision de las atenciones guardadas")
 
-    '''
-    if args.local_rank == -1 or args.no_cuda:
-        device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
-        n_gpu = torch.cuda.device_count()
-    '''
+    parser.add_argument("--attn_format",
+                        default="npy",
+                        choices=["npy", "pkl"],
+                        type=str,
+                        help="Contenedor de atenciones por documento: blob npy con indice (memmap) o pickle")
 
+    parser.add_argument("--check_step5",
+                        action="store_true",
+                        help="Comprueba el map_attn vectorizado del step 5 contra la version original por bucles")
 
+    parser.add_argument("--workers",
+                        default=1,
+                        type=int,
+                        help="Procesos para repartir los documentos en los steps 5-10 (cada uno carga su modelo y spaCy)")
 
-    modelname= args.model_name_or_path# 'roberta-base'# 'PlanTL-GOB-ES/roberta-base-bne' #'roberta-base'#PlanTL-GOB-ES/roberta-base-bne' #' #'roberta-base'  #'bert-base-uncased'
-    type= args.model_type #'roberta'
-    lang= args.lang #'en'
-    dataset_name = args.dataset_name # 'example'     #dataset_name = 'SemEval2018' #dataset_name = 'SemEval2010_GTP3'
+    parser.add_argument("--fused",
+                        action="store_true",
+                        help="Una sola pasada por frase en los steps 1-4 que guarda atenciones y embeddings del step 9, sin el segundo modelo del pipeline")
 
-    k_val = int(args.k_value)
+    parser.add_argument("--embedding_format",
+                        default="npy",
+                        choices=["npy", "csv"],
+                        type=str,
+                        help="Formato de los embeddings de los steps 8 y 9: blob npy con indice o csv")
 
-    # if type== 'bert':
-    #     tokenizer = BertTokenizer.from_pretrained(modelname)
-    #     model = TFBertModel.from_pretrained(modelname)
+    parser.add_argument("--embedding_dtype",
+                        default="float32",
+                        choices=["float32", "float16"],
+                        type=str,
+                        help="Precision de los embeddings guardados en formato npy")
 
-    # else:
-    #     tokenizer = AutoTokenizer.from_pretrained(modelname)
-    #     model = AutoModel.from_pretrained(modelname, output_attentions=True)
+    parser.add_argument("--step10_engine",
+                        default="batched",
+                        choices=["batched", "loop"],
+                        type=str,
+                        help="Calculo del step 10: tensores rellenos por documento o la version original por bucles")
 
-    tokenizer = AutoTokenizer.from_pretrained(modelname)
-    model = AutoModel.from_pretrained(modelname, output_attentions=True)
+    parser.add_argument("--step10_memory_mb",
+                        default=512,
+                        type=int,
+                        help="Pico de memoria aproximado en MB del step 10 por lotes, por documento y por worker")
 
+    parser.add_argument("--spacy_processes",
+                        default=1,
+                        type=int,
+                        help="Procesos de nlp.pipe para generar los candidatos de todos los documentos en el step 6")
 
+    #parser.add_argument("--local_rank",
+    #                    default=-1,
+    #                    type=int,
+    #                    help="local_rank for distributed training on gpus")
 
-    bertemb= ModelEmbedding(modelname,type, tokenizer, model)
-    candidategen = CandidatesGenerator(lang)
+    #parser.add_argument("--no_cuda",
+    #                    action="store_true",
+    #                    help="Whether not to use CUDA when available")
+    return parser
 
 
+def run_pipeline(args, bertemb, candidategen, dataset_name):
+    """Steps 1-11 sobre ./<dataset_name>/docsutf8 con los modelos ya cargados"""
+    type= args.model_type
+    lang= args.lang
+    modelname= args.model_name_or_path
+    k_val = int(args.k_value)
+
     # PATHS
     update_paths(dataset_name)
     update_paths_eval(dataset_name)
@@ -113,35 +158,52 @@ if __name__ == '__main__':
 
 
     ## step 1-4
-    preprocessing_module(bertemb,type,lang)  #,tokenizer,model
+    attn_layers = [int(layer) for layer in args.attn_layers.split(',')]
+    preprocessing_module(bertemb,type,lang, args.batch_size, args.max_batch_tokens, args.batch_docs,
+                         args.attn_storage, attn_layers, args.attn_dtype, args.attn_format, args.fused,
+                         args.embedding_format, args.embedding_dtype)  #,tokenizer,model
+
+    # Pool de procesos compartido por los steps 5-10
+    pool = None
+    if args.workers > 1:
+        pool = make_pool(args.workers, dataset_name, modelname, type, lang, args.fused)
+
     ## step 5
     print('STEP 5')
-    step_5(lang,bertemb,candidategen)
+    step_5(lang,bertemb,candidategen, args.check_step5, pool)
 
     # Si solo queremos ejecutar hasta el step 5, salimos aqui
     if args.exec_step == 'step5':
+        if pool is not None:
+            pool.close()
+            pool.join()
         print("Se ha indicado detenerse tras STEP 5. Finalizando ejecucion.")
-        sys.exit(0)
+        return
 
     ## step 6
     print('STEP 6')
-    step6( 512,20000)
+    step6( 512,20000, pool, args.spacy_processes)
     ## step 7
     print('STEP 7')
-    step7()
+    step7(pool)
     ## step 8
 
     print('STEP 8')
 
-    step8(bertemb,candidategen,lang)
+    step8(bertemb,candidategen,lang, pool, args.embedding_format, args.embedding_dtype)
     ## step 9
     print('STEP 9')
 
-    step9(bertemb)
+    step9(bertemb, pool, args.embedding_format, args.embedding_dtype, lang)
     ## step 10
     print('STEP 10')
 
-    step10(lang)
+    step10(lang, pool, args.step10_engine, args.step10_memory_mb)
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
     ## step 11
 
     generate_results(lang,k_val)
@@ -152,22 +214,50 @@ if __name__ == '__main__':
     
 
 
+if __name__ == '__main__':
+    # torch/transformers y spaCy solo se importan al ejecutar, no al importar main desde server.py
+    from transformers import AutoModel, AutoTokenizer
+    from src.attentionrank.CandidatesGenerator import CandidatesGenerator
+    from src.attentionrank.ModelEmbedding import ModelEmbedding
 
+    parser = build_parser()
+    args = parser.parse_args()
 
+    #start = time.time()
+    #log = Logger(args.log_dir + args.dataset_name + '.kpe.' + args.doc_embed_mode + '.log')
 
 
 
 
+    '''
+    if args.local_rank == -1 or args.no_cuda:
+        device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+        n_gpu = torch.cuda.device_count()
+    '''
 
 
 
+    modelname= args.model_name_or_path# 'roberta-base'# 'PlanTL-GOB-ES/roberta-base-bne' #'roberta-base'#PlanTL-GOB-ES/roberta-base-bne' #' #'roberta-base'  #'bert-base-uncased'
+    type= args.model_type #'roberta'
+    lang= args.lang #'en'
+    dataset_name = args.dataset_name # 'example'     #dataset_name = 'SemEval2018' #dataset_name = 'SemEval2010_GTP3'
 
+    k_val = int(args.k_value)
 
+    # if type== 'bert':
+    #     tokenizer = BertTokenizer.from_pretrained(modelname)
+    #     model = TFBertModel.from_pretrained(modelname)
 
+    # else:
+    #     tokenizer = AutoTokenizer.from_pretrained(modelname)
+    #     model = AutoModel.from_pretrained(modelname, output_attentions=True)
 
+    tokenizer = AutoTokenizer.from_pretrained(modelname)
+    model = AutoModel.from_pretrained(modelname, output_attentions=True)
 
 
 
+    bertemb= ModelEmbedding(modelname,type, tokenizer, model, args.fused)
+    candidategen = CandidatesGenerator(lang)
 
-
-
+    run_pipeline(args, bertemb, candidategen, dataset_name)
@@ -0,0 +1,212 @@
+"""
+Servidor local de AttentionRank con el modelo, el tokenizer y spaCy cargados una sola vez.
+
+POST /extract  {"documents": [{"id": "a", "text": "..."}, ...], "k": 10}   (o {"text": "..."})
+  -> {"keyphrases": {"a": [...], ...}}
+GET /health    -> {"status": "ok"}
+
+Las peticiones concurrentes se juntan en micro-lotes (hasta --max_batch_docs documentos o
+--batch_wait segundos). Los steps trabajan sobre ficheros, asi que cada micro-lote se escribe en
+una carpeta de dataset temporal, se ejecutan los steps 1-11 y se borra la carpeta.
+
+MicroBatcher, parse_documents, ExtractHandler y ThreadingUnixHTTPServer estan duplicados en
+mdeRank/MDERank/mderank_server.py: cada subproyecto se construye por separado (su Dockerfile
+copia solo su carpeta), asi que cualquier cambio en esta capa HTTP hay que hacerlo en los dos.
+"""
+import json
+import os
+import queue
+import shutil
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from transformers import AutoModel, AutoTokenizer
+
+from main import build_parser, run_pipeline
+from src.attentionrank.CandidatesGenerator import CandidatesGenerator
+from src.attentionrank.ModelEmbedding import ModelEmbedding
+
+
+class MicroBatcher:
+    """Junta los documentos de peticiones concurrentes y los procesa en un unico hilo"""
+
+    def __init__(self, process_batch, max_docs=32, wait=0.05):
+        self.process_batch = process_batch
+        self.max_docs = max_docs
+        self.wait = wait
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, documents):
+        """Encola una lista de textos; el Future devuelve la lista de keyphrases de cada uno"""
+        future = Future()
+        self.queue.put((documents, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            n_docs = len(batch[0][0])
+            deadline = time.monotonic() + self.wait
+            while n_docs < self.max_docs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_docs += len(item[0])
+
+            try:
+                results = self.process_batch([text for documents, _ in batch for text in documents])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for documents, future in batch:
+                future.set_result(results[start:start + len(documents)])
+                start += len(documents)
+
+
+class Extractor:
+    """Modelos cargados una vez; ejecuta el pipeline sobre un dataset temporal por micro-lote"""
+
+    def __init__(self, args):
+        self.args = args
+        tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path)
+        model = AutoModel.from_pretrained(args.model_name_or_path, output_attentions=True)
+        self.bertemb = ModelEmbedding(args.model_name_or_path, args.model_type, tokenizer, model, args.fused)
+        self.candidategen = CandidatesGenerator(args.lang)
+        self.n_batches = 0
+
+    def __call__(self, texts):
+        self.n_batches += 1
+        dataset_name = '_serve_%d_%d' % (os.getpid(), self.n_batches)
+        docs_folder = os.path.join('.', dataset_name, 'docsutf8')
+        os.makedirs(docs_folder)
+        try:
+            names = ['doc%05d' % i for i in range(len(texts))]
+            for name, text in zip(names, texts):
+                with open(os.path.join(docs_folder, name + '.txt'), 'w', encoding='utf-8') as f:
+                    f.write(text)
+
+            run_pipeline(self.args, self.bertemb, self.candidategen, dataset_name)
+
+            res_folder = os.path.join('.', dataset_name, 'res' + str(self.args.k_value))
+            results = []
+            for name in names:
+                key_file = os.path.join(res_folder, name + '.key')
+                if not os.path.exists(key_file):
+                    results.append([])
+                    continue
+                with open(key_file, encoding='utf-8') as f:
+                    results.append([line.strip() for line in f if line.strip()])
+            return results
+        finally:
+            shutil.rmtree(os.path.join('.', dataset_name), ignore_errors=True)
+
+
+def parse_documents(payload):
+    """Lista de (id, texto) de una peticion {"documents": [...]} o {"text": ...}"""
+    if 'documents' in payload:
+        documents = payload['documents']
+    else:
+        documents = [{'id': payload.get('id', '0'), 'text': payload['text']}]
+    parsed = []
+    for i, document in enumerate(documents):
+        if isinstance(document, str):
+            parsed.append((str(i), document))
+        else:
+            parsed.append((str(document.get('id', i)), document['text']))
+        # un texto que no es str fallaria dentro del micro-lote y tiraria tambien las peticiones vecinas
+        if not isinstance(parsed[-1][1], str):
+            raise TypeError('text of document %s is not a string' % parsed[-1][0])
+    return parsed
+
+
+class ExtractHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # en un socket Unix client_address no es (host, puerto)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/extract':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            documents = parse_documents(payload)
+            k = int(payload.get('k', self.server.k_value))
+            # los resultados ya vienen cortados a --k_value: un k mayor devolveria menos sin avisar
+            if not 1 <= k <= self.server.k_value:
+                raise ValueError('k must be between 1 and %d' % self.server.k_value)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, {'error': 'bad request: %s' % e})
+            return
+
+        try:
+            results = self.server.batcher.submit([text for _, text in documents]).result()
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'keyphrases': {doc_id: keyphrases[:k]
+                                            for (doc_id, _), keyphrases in zip(documents, results)}})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    parser = build_parser()
+    # el dataset lo crea el servidor en cada micro-lote
+    for action in parser._actions:
+        if action.dest == 'dataset_name':
+            action.required = False
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="HTTP host")
+    parser.add_argument("--port", default=8764, type=int, help="HTTP port")
+    parser.add_argument("--socket", default=None, type=str, help="Serve on this Unix socket path instead of TCP")
+    parser.add_argument("--max_batch_docs", default=32, type=int, help="Documents per micro-batch")
+    parser.add_argument("--batch_wait", default=0.05, type=float,
+                        help="Seconds to wait for more concurrent requests before running a micro-batch")
+    args = parser.parse_args()
+    # sin evaluacion y con el pipeline completo; los workers cargarian otra copia del modelo por lote
+    args.type_execution = 'exec'
+    args.exec_step = 'all'
+    args.workers = 1
+
+    extractor = Extractor(args)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, ExtractHandler)
+        print("AttentionRank serving on unix:" + args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ExtractHandler)
+        print("AttentionRank serving on http://%s:%d" % (args.host, args.port))
+    server.batcher = MicroBatcher(extractor, args.max_batch_docs, args.batch_wait)
+    server.k_value = int(args.k_value)
+    server.serve_forever()
@@ -1,6 +1,9 @@
 import spacy
 import re
 
+# Componentes que la extraccion de noun chunks no usa (solo hacen falta POS y dependencias)
+UNUSED_COMPONENTS = ('ner', 'lemmatizer')
+
 
 class CandidatesGenerator():
 
@@ -23,6 +26,20 @@ class CandidatesGenerator():
         else:
             candidates = self.__generate_candidates_en(text)
             return candidates
+
+    def generate_candidates_batch(self, texts, n_process=1, batch_size=64):
+        """
+        Candidatos de varios textos con nlp.pipe, sin los componentes que no usan los noun chunks.
+        Devuelve una lista de candidatos por texto, en el mismo orden.
+        """
+        disable = [name for name in UNUSED_COMPONENTS if name in self.nlp.pipe_names]
+        results = []
+        for doc in self.nlp.pipe(texts, n_process=n_process, batch_size=batch_size, disable=disable):
+            if self.lang == 'es':
+                results.append(self.__candidates_from_doc_es(doc))
+            else:
+                results.append(self.__candidates_from_doc_en(doc))
+        return results
     def remove_starting_articles(self,text):
             # Lista de artículos a eliminar
 
@@ -42,8 +59,10 @@ class CandidatesGenerator():
             return text
 
     def __generate_candidates_es(self,text):
+        return self.__candidates_from_doc_es(self.nlp(text))
+
+    def __candidates_from_doc_es(self, doc):
         candidates = []
-        doc = self.nlp(text)
         lis = []
         for chunk in doc.noun_chunks:
             if len(chunk.text) < 2:
@@ -94,8 +113,10 @@ class CandidatesGenerator():
         return candiate.strip()
 
     def __generate_candidates_en(self, text):
+        return self.__candidates_from_doc_en(self.nlp(text))
+
+    def __candidates_from_doc_en(self, doc):
         candidates = []
-        doc = self.nlp(text)
         for chunk in doc.noun_chunks:
             # chunk.root.dep_, chunk.root.head.text)
             chunk_processed = self.remove_starting_articles(chunk.text.lower())
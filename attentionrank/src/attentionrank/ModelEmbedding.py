@@ -1,11 +1,14 @@
+import torch
 from transformers import pipeline, AutoTokenizer, AutoModel
 
 
 
 class ModelEmbedding():
 
-    def __init__(self, model_name, type, tokenizer, model):
-        self.extractor = pipeline(model=model_name, task="feature-extraction")
+    def __init__(self, model_name, type, tokenizer, model, fused=False):
+        # fused: los embeddings salen de self.model y no se carga un segundo modelo en el pipeline
+        self.fused = fused
+        self.extractor = None if fused else pipeline(model=model_name, task="feature-extraction")
         self.tokenizer = tokenizer
         self.model= model
         self.type = type
@@ -15,15 +18,31 @@ class ModelEmbedding():
         if self.type=='roberta':
             if len(data)>0:
                 data[0]= ' '+data[0].lower()
-        result = self.extractor(data, return_tensors=True,truncation=True)
+        result = self.extract_features(data)
 
         if data=='':
             data='None'
         ids = self.tokenizer(data,truncation=True)
         lis = []
         for res, input in zip(result, ids['input_ids']):
-            lis.append((input, res[0].cpu().detach().numpy()))
+            lis.append((input, res))
 
+        return self.construct_embeddings(lis)
+
+    def extract_features(self, data):
+        """Ultima capa oculta (L, dim) de cada texto, con el pipeline o con el propio self.model"""
+        if self.extractor is not None:
+            result = self.extractor(data, return_tensors=True,truncation=True)
+            return [res[0].cpu().detach().numpy() for res in result]
+
+        encoded_input = self.tokenizer(data, return_tensors='pt', truncation=True, padding=True)
+        with torch.no_grad():
+            output = self.model(**encoded_input)
+        lengths = encoded_input['attention_mask'].sum(dim=1).tolist()
+        hidden = output.last_hidden_state.cpu().numpy()
+        return [hidden[i, :length] for i, length in enumerate(lengths)]
+
+    def construct_embeddings(self, lis):
         if self.type == 'bert':
             return self.embedding_constructor_bert(lis)
         if self.type == 'roberta':
@@ -179,10 +198,15 @@ class ModelEmbedding():
         return sentences
 
 
+    def attention_input(self, sentence):
+        # Normalizacion de la frase antes de extraer atenciones (igual en modo frase a frase y por lotes)
+        if self.type == 'roberta':
+            return ' ' + separar_caracteres(sentence).lower()
+        return sentence
+
     def getAttentions(self,sentence):
         if self.type == 'roberta':
-            sentence = separar_caracteres(sentence)
-            encoded_input = self.tokenizer(' ' + sentence.lower(), return_tensors='pt',truncation=True)
+            encoded_input = self.tokenizer(self.attention_input(sentence), return_tensors='pt',truncation=True)
             output = self.model(**encoded_input)
             attentions = output.attentions
 
@@ -192,6 +216,28 @@ class ModelEmbedding():
             attentions = output.attentions
         return attentions,encoded_input
 
+    def count_tokens(self, sentences):
+        """Numero de tokens (con especiales y truncado) que ocupara cada frase en getAttentionsBatch"""
+        encoded = self.tokenizer([self.attention_input(s) for s in sentences], truncation=True)
+        return [len(ids) for ids in encoded['input_ids']]
+
+    def forwardBatch(self, sentences):
+        """
+        Una sola pasada del modelo para varias frases con padding a la mas larga del lote.
+        Devuelve la salida completa (atenciones y last_hidden_state), la entrada codificada
+        y la longitud real (sin padding) de cada frase para poder recortar sus mapas.
+        """
+        encoded_input = self.tokenizer([self.attention_input(s) for s in sentences],
+                                       return_tensors='pt', truncation=True, padding=True)
+        with torch.no_grad():
+            output = self.model(**encoded_input, output_attentions=True)
+        lengths = encoded_input['attention_mask'].sum(dim=1).tolist()
+        return output, encoded_input, lengths
+
+    def getAttentionsBatch(self, sentences):
+        output, encoded_input, lengths = self.forwardBatch(sentences)
+        return output.attentions, encoded_input, lengths
+
     def get_tokens(self,line):
         if self.type == 'roberta':
             tokens = self.tokenizer.tokenize(' '+line)
@@ -1,25 +1,20 @@
-from transformers import pipeline, AutoTokenizer, AutoModel
-
-from .preprocessing import separate_sentences
-from .utils import clean_folder, write_csv_file, get_files_from_path,get_files_ids
+from .preprocessing import separate_sentences, column_attention, save_sentence_embeddings, filter_word_set
+from .utils import clean_folder, write_csv_file, get_files_from_path,get_files_ids, load_array_store, write_array_store
 import numpy as np
 import pickle
 import os
 
 import time
 import random
-import torch
-from torch import nn
-from string import punctuation
-import nltk
-from nltk.corpus import stopwords
 from tqdm import tqdm
 import sys
 from .utils import convert_to_unicode
 from .utils import get_files_ids
 import csv
-
-nltk.download('stopwords')
+import json
+import hashlib
+import multiprocessing
+from functools import partial
 
 
 
@@ -44,12 +39,84 @@ def update_paths(dataset_name):
 
 
 
+#### EJECUCION POR DOCUMENTO ####
+def set_csv_field_size_limit():
+    maxInt = sys.maxsize
+
+    while True:
+        # decrease the maxInt value by factor 10
+        # as long as the OverflowError occurs.
+        try:
+            csv.field_size_limit(maxInt)
+            break
+        except OverflowError:
+            maxInt = int(maxInt / 10)
+
+
+def init_worker(dataset_name, model_name, model_type, lang, threads, fused=False):
+    """Inicializa un proceso del pool con sus propias rutas, modelo y spaCy"""
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+    from . import preprocessing
+    from .ModelEmbedding import ModelEmbedding
+    from .CandidatesGenerator import CandidatesGenerator
+
+    global ModelEmb, NounModel, language
+    update_paths(dataset_name)
+    preprocessing.update_paths_preprocessing(dataset_name)
+    preprocessing.lang = lang
+    language = lang
+    set_csv_field_size_limit()
+
+    # repartir los cores entre los procesos en vez de que cada uno use todos
+    torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name, output_attentions=True)
+    ModelEmb = ModelEmbedding(model_name, model_type, tokenizer, model, fused)
+    NounModel = CandidatesGenerator(lang)
+
+
+def make_pool(workers, dataset_name, model_name, model_type, lang, fused=False):
+    """Pool de procesos para los steps 5-10; se crea una vez y se reutiliza en todos los steps"""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: no heredar el estado de torch/OpenMP del proceso principal
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(workers, initializer=init_worker,
+                        initargs=(dataset_name, model_name, model_type, lang, threads, fused))
+
+
+def map_documents(pool, func, files):
+    """Aplica func a cada documento, en serie o repartido en el pool, manteniendo el orden de files"""
+    if pool is None:
+        return map(func, files)
+    return pool.imap(func, files)
+
+
 #### STEP 5 ####
 def load_pickle(fname):
     with open(fname, "rb") as f:
         return pickle.load(f, encoding="latin1")  # add, encoding="latin1") if using python3 and downloaded data
 
 
+def load_attentions(base_path):
+    """
+    Atenciones por frase de un documento de preprocessing. El formato npy se abre en modo
+    memmap, asi que cada frase es una vista del blob y solo se lee la parte que se usa.
+    """
+    if not os.path.exists(base_path + '.npy'):
+        return load_pickle(base_path + '.pkl')
+
+    index, arrays = load_array_store(base_path)
+    data = []
+    for tokens, array in zip(index['tokens'], arrays):
+        example = {'tokens': tokens, index['key']: array}
+        if 'layers' in index:
+            example['layers'] = index['layers']
+            example['num_layers'] = index['num_layers']
+        data.append(example)
+    return data
+
+
 def weights_comb(input_weights, strategy=3):
     if strategy == 1:
         comb_weight = np.array(input_weights).mean()
@@ -107,13 +174,31 @@ def merge_dict(x, y):
             y[k] = v
 
 
+def stored_layer_index(example, layer):
+    """
+    Posicion de `layer` dentro de lo guardado en preprocessing: si se guardaron todas las
+    capas es la propia capa; si solo algunas ('layers'), su indice en esa lista.
+    """
+    layers = example.get("layers")
+    if layers is None:
+        return layer
+    if layer < 0:
+        layer += example["num_layers"]
+    return layers.index(layer)
+
+
+def token_key(token):
+    # igual que el recorte de las claves "token_posicion" de map_attn
+    return token.split("_", 1)[0]
+
+
 def map_attn(example, heads, sentence_length, layer_weight, record):
     counter_12 = 0  # check head index
 
     current_sum_attn = []
     for ei, (layer, head) in enumerate(heads):
-        attn = example["attns"][layer][head]  # [0:sentence_length, 0:sentence_length]
-        attn = np.array(attn)
+        attn = example["attns"][stored_layer_index(example, layer)][head]  # [0:sentence_length, 0:sentence_length]
+        attn = np.array(attn, dtype=np.float32)
         attn /= attn.sum(axis=-1, keepdims=True)  # norm each row
         attn_sum = attn.sum(axis=0, keepdims=True)  # add up 12 heads # np.shape(attn_sum) = (1,sentence length)
         words = example["tokens"]  # [0:sentence_length]
@@ -144,11 +229,37 @@ def map_attn(example, heads, sentence_length, layer_weight, record):
             return current_dict
 
 
+def map_attn_vectorized(example, layer, layer_weight):
+    """
+    Version vectorizada de map_attn: la atencion acumulada de todos los heads de la capa se
+    calcula en una sola operacion sobre el array (heads, L, L). Devuelve la lista de tokens
+    (recortados como las claves de map_attn) y el array de pesos, en el orden de la frase.
+    """
+    tokens = [token_key(token) for token in example["tokens"]]
+    if "colsum" in example:
+        # preprocessing ya guardo la atencion acumulada de la capa
+        scores = np.asarray(example["colsum"][stored_layer_index(example, layer)], dtype=np.float32)
+    else:
+        scores = column_attention(example["attns"][stored_layer_index(example, layer)])
+    return tokens, scores * layer_weight
+
+
+def check_map_attn(example, layer, layer_weight, record, tokens, scores):
+    """Compara la salida vectorizada con el map_attn original y avisa si no coinciden"""
+    heads = [(layer, head) for head in range(12)]
+    sentence_dict = map_attn(example, heads, len(example["tokens"]), layer_weight, record)
+    reference_tokens = [k[0:k.find("_")] for k in sentence_dict.keys()]
+    reference_scores = np.array(list(sentence_dict.values()), dtype=np.float32)
+    if reference_tokens != tokens or not np.allclose(reference_scores, scores, rtol=1e-5, atol=1e-6):
+        print('[STEP 5] map_attn vectorizado no coincide en la frase', record,
+              'max diff', np.abs(reference_scores - scores).max() if len(scores) == len(reference_scores) else None)
+
+
 def clean_id(file_name):
     return file_name[:-4]
 
 
-def step_5(lang,bertemb,nounmodel):
+def step_5(lang,bertemb,nounmodel, check=False, pool=None):
 
     global language
     language=lang
@@ -195,51 +306,117 @@ def step_5(lang,bertemb,nounmodel):
     else:
         clean_folder(save_path)
 
-    bert_name = "orgbert"
-
     #print('Save Path:' + save_path)
-    for n, f in enumerate(files):
-
-        ide = clean_id(f)
-
-        if os.path.exists(os.path.join(save_path, ide + "token_attn_paired.csv")):
-            print('already')
-            continue
-        attn_extracting_dir = os.path.join(PROCESSED_FOLDER , "sentence_paired_text",  ide + '_' + bert_name + '_attn.pkl')
-        data = load_pickle(attn_extracting_dir)
-        #print(save_path + ide + "token_attn_paired.csv")
-        # w = csv.writer(open(save_path + file + "token_attn_paired.csv", "w"))
-        rows = []
-        for r in range(len(data)):
-            record = r
-            sentence_length = len(data[record]['tokens'])
-
-            # consider the 12th layer
-            weight = 1
-            layer = 11
-            sentence_dict = map_attn(data[record],
-                                     [(layer, 0), (layer, 1), (layer, 2), (layer, 3),
-                                      (layer, 4), (layer, 5), (layer, 6), (layer, 7),
-                                      (layer, 8), (layer, 9), (layer, 10), (layer, 11)],
-                                     sentence_length, weight, record)
-
-            # print('words:', len(document_dict))
-
-            for k, v in sentence_dict.items():
-                cut = k.find(
-                    "_")  # although we do not keep word position, word position helps to keep its original order
-                k_short = k[0:cut]
-                # w.writerow([k_short, v])
-                rows.append([k_short, v])
-
-        write_csv_file(os.path.join(save_path,  ide + "token_attn_paired.csv"), rows, 'w')
+    for n, ide in enumerate(map_documents(pool, partial(step_5_file, check=check), files)):
         run_time = time.time()
         print(n + 1, "th file", ide, "running time", run_time - start_time)
 
 
-def step6(  max_sequence_length, num_docs):
+def step_5_file(f, check=False):
+    save_path = os.path.join(PROCESSED_FOLDER , "token_attn_paired" , "attn")
+    bert_name = "orgbert"
+
+    ide = clean_id(f)
+
+    if os.path.exists(os.path.join(save_path, ide + "token_attn_paired.csv")):
+        print('already')
+        return ide
+    attn_extracting_dir = os.path.join(PROCESSED_FOLDER , "sentence_paired_text",  ide + '_' + bert_name + '_attn')
+    data = load_attentions(attn_extracting_dir)
+    #print(save_path + ide + "token_attn_paired.csv")
+    # w = csv.writer(open(save_path + file + "token_attn_paired.csv", "w"))
+    rows = []
+    for r in range(len(data)):
+        record = r
+
+        # consider the last layer (the 12th in base models)
+        weight = 1
+        layer = -1
+
+        tokens, scores = map_attn_vectorized(data[record], layer, weight)
+        if check and 'attns' in data[record]:
+            check_map_attn(data[record], layer, weight, record, tokens, scores)
+
+        # although we do not keep word position, rows keep the original word order
+        rows.extend(zip(tokens, scores))
+
+    write_csv_file(os.path.join(save_path,  ide + "token_attn_paired.csv"), rows, 'w')
+    return ide
+
+
+def read_candidate_text(file):
+    """Texto de un documento normalizado igual para todos los steps que generan candidatos"""
+    with open(os.path.join(DOCS_FOLDER, file + '.txt'), "r", encoding="utf-8") as f:
+        return f.read().replace('$$$$$$', ' ')
+
+
+def candidate_digest(text):
+    """Hash de la cache de candidatos: texto, idioma y tokenizer"""
+    key = '\n'.join([NounModel.lang, getattr(ModelEmb.tokenizer, 'name_or_path', ''), text])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_cached_candidates(file, digest):
+    """Entrada de candidate_cache/<file>.json si existe y su hash coincide, si no None"""
+    cache_file = os.path.join(PROCESSED_FOLDER, 'candidate_cache', file + '.json')
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, encoding="utf-8") as f:
+        cached = json.load(f)
+    return cached if cached.get('hash') == digest else None
+
+
+def store_candidates(file, digest, candidates):
+    """Tokeniza los candidatos con el modelo y guarda la entrada de la cache"""
+    tokens = [ModelEmb.get_tokens(convert_to_unicode(line).strip()) for line in candidates]
+    cached = {'hash': digest, 'candidates': candidates, 'tokens': tokens}
+
+    # exist_ok y os.replace: varios procesos del pool pueden escribir a la vez
+    cache_path = os.path.join(PROCESSED_FOLDER, 'candidate_cache')
+    os.makedirs(cache_path, exist_ok=True)
+    cache_file = os.path.join(cache_path, file + '.json')
+    tmp_file = cache_file + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_file, 'w', encoding="utf-8") as f:
+        json.dump(cached, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+    return cached
+
+
+def document_candidates(file):
+    """
+    Candidatos de un documento (una pasada de spaCy) y su tokenizacion con el modelo.
+    Se guardan en candidate_cache/<file>.json con el hash del texto, idioma y tokenizer,
+    y los steps 6 y 8 los reutilizan mientras el hash coincida.
+    """
+    text = read_candidate_text(file)
+    digest = candidate_digest(text)
+    cached = load_cached_candidates(file, digest)
+    if cached is not None:
+        return cached
+    return store_candidates(file, digest, NounModel.generate_candidates(text) or [])
+
+
+def prefill_candidate_cache(files, n_process=1, batch_size=64):
+    """
+    Calcula de una vez, con nlp.pipe, los candidatos de los documentos que aun no estan en la cache.
+    """
+    pending = []
+    for file in files:
+        text = read_candidate_text(file)
+        digest = candidate_digest(text)
+        if load_cached_candidates(file, digest) is None:
+            pending.append((file, digest, text))
+    if not pending:
+        return
+    all_candidates = NounModel.generate_candidates_batch([text for _, _, text in pending], n_process, batch_size)
+    for (file, digest, _), candidates in zip(pending, all_candidates):
+        store_candidates(file, digest, candidates)
+
+
+def step6(  max_sequence_length, num_docs, pool=None, spacy_processes=1):
     """
         Candidate generation step
+        Los candidatos se generan antes en bloque (nlp.pipe) y los documentos leen la cache.
     """
     start_time = time.time()
 
@@ -247,21 +424,16 @@ def step6(  max_sequence_length, num_docs):
     #reading_path = os.path.join(root_folder, 'docsutf8')
 
     files = get_files_from_path(DOCS_FOLDER)
+    prefill_candidate_cache(get_files_ids(list(files)), spacy_processes)
 
-    for f in files:
-        step6_file( f, max_sequence_length, num_docs)
-
+    step = partial(step6_file, max_sequence_length=max_sequence_length, num_docs=num_docs)
+    for f in map_documents(pool, step, files):
         run_time = time.time()
         print("th file", f, "running time", run_time - start_time)
         # break
 
 
 def step6_file( filename, max_sequence_length, num_docs):
-    #thefile = "./" + dataset + "/docsutf8/" + filename
-    thefile = os.path.join(DOCS_FOLDER , filename )
-    with open(thefile, 'r',encoding="utf-8") as f:
-        text = f.read().replace('\n', '')
-
     # dataset = 'SemEval2017'
     #text_path = './' + dataset + '/docsutf8/'
     #output_path = './' + dataset + '/processed_' + dataset + '/'
@@ -270,41 +442,31 @@ def step6_file( filename, max_sequence_length, num_docs):
     file = filename.replace(".txt", "")  # S0010938X1500195X"
 
 
-    if not os.path.exists(save_path):
-        os.makedirs(save_path)
+    # exist_ok: varios procesos del pool pueden crearla a la vez
+    os.makedirs(save_path, exist_ok=True)
     if os.path.exists(os.path.join(save_path , file + '_candidate_tokenized.csv')):
         print('already')
-        return
+        return filename
     #print(text)
 
-    candidates = NounModel.generate_candidates(text)
+    cached = document_candidates(file)
+    candidates = cached['candidates']
     print('Candidates', candidates)
 
     # Si no hay candidatos, saltar este fichero
     if not candidates:
         print(f"[STEP 6] Sin candidatos para {file}, se salta este fichero.")
-        return
+        return filename
 
     # w = csv.writer(open(save_path + file + "_candidate_tokenized.csv", "w"))
     rows = []
-    # tokenize candidates
-    raw_lines = []
-    current_doc_tokens = []
+    # tokenize candidates (ya calculado en la cache de candidatos)
     df_dict = {}
     #print(candidates)
-    for l, line in enumerate(candidates):
-        raw_lines.append(line)
-
+    for line, tokens in zip(candidates, cached['tokens']):
         line = convert_to_unicode(line).strip()  # tokenization.convert_to_unicode(line).strip()
-        segments = []
-
-        tokens= ModelEmb.get_tokens(line)
-
         rows.append([line, tokens])
 
-        if tokens:  # if line is not empty, add lines to [current doc tokens]
-            current_doc_tokens.append(tokens)
-
     write_csv_file(os.path.join(save_path , file + '_candidate_tokenized.csv'), rows)
 
     # get tf
@@ -333,22 +495,20 @@ def step6_file( filename, max_sequence_length, num_docs):
         # w1.writerow([k, v])
         rows.append([k, v])
     write_csv_file(os.path.join(save_path , file + '_candidate_df.csv'), rows)
+    return filename
 
 
 #### STEP 7 ####
 """pair candidates and their accumulated self-attention"""
 
 
-def step7():
+def step7(pool=None):
     """
         Candidate attention pairing step
     """
     # dataset = 'SemEval2017'
     #doc_path = './' + dataset + '/' + 'docsutf8/'
     #output_path = './' + dataset + '/processed_' + dataset + '/'
-    candidate_token_path = os.path.join(PROCESSED_FOLDER , 'candidate_tokenizing')
-    token_attn_path = os.path.join(PROCESSED_FOLDER , 'token_attn_paired','attn')
-
     save_path = os.path.join(PROCESSED_FOLDER , 'candidate_attn_paired')
 
     if not os.path.exists(save_path):
@@ -360,44 +520,53 @@ def step7():
 
     start_time = time.time()
 
-    for n, file in enumerate(files):
-        print(file)
-        if os.path.exists(os.path.join(save_path , file + "_attn_paired.csv")):
-            print('already')
-            continue
-
-        # rutas a los ficheros necesarios
-        token_attn_file = os.path.join(token_attn_path , file + "token_attn_paired.csv")
-        candidate_tok_file = os.path.join(candidate_token_path, file + "_candidate_tokenized.csv")
-
-        # si falta alguno de los dos, saltamos este fichero
-        if not os.path.exists(token_attn_file):
-            print(f"[STEP 7] No token_attn_paired para {file}, se salta este fichero.")
-            continue
-        if not os.path.exists(candidate_tok_file):
-            print(f"[STEP 7] No candidate_tokenized para {file}, se salta este fichero.")
-            continue
-
-        # read token attn to list
-        token_list = []
-        attn_list = []
-        with open(token_attn_file, newline='', encoding="utf-8") as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=',')
-            for row in spamreader:
-                k = row[0]
-                v = float(row[1])
-                token_list.append(k)
-                attn_list.append(v)
-
-        # read candidate tokens to dict
-        candidate_token_dict = {}
-        #print(candidate_token_path + file + "_candidate_tokenized.csv")
-        with open(candidate_tok_file, newline='', encoding="utf-8") as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=',')
-            for row in spamreader:
-                k = row[0]
-                v = row[1][2:-2].split("', '")
-                candidate_token_dict[k] = v
+    for n, file in enumerate(map_documents(pool, step7_file, files)):
+        print(n + 1, "th file", file, "running time", time.time() - start_time)
+
+
+def step7_file(file):
+    candidate_token_path = os.path.join(PROCESSED_FOLDER , 'candidate_tokenizing')
+    token_attn_path = os.path.join(PROCESSED_FOLDER , 'token_attn_paired','attn')
+    save_path = os.path.join(PROCESSED_FOLDER , 'candidate_attn_paired')
+
+    print(file)
+    if os.path.exists(os.path.join(save_path , file + "_attn_paired.csv")):
+        print('already')
+        return file
+
+    # rutas a los ficheros necesarios
+    token_attn_file = os.path.join(token_attn_path , file + "token_attn_paired.csv")
+    candidate_tok_file = os.path.join(candidate_token_path, file + "_candidate_tokenized.csv")
+
+    # si falta alguno de los dos, saltamos este fichero
+    if not os.path.exists(token_attn_file):
+        print(f"[STEP 7] No token_attn_paired para {file}, se salta este fichero.")
+        return file
+    if not os.path.exists(candidate_tok_file):
+        print(f"[STEP 7] No candidate_tokenized para {file}, se salta este fichero.")
+        return file
+
+    # read token attn to list
+    token_list = []
+    attn_list = []
+    with open(token_attn_file, newline='', encoding="utf-8") as csvfile:
+        spamreader = csv.reader(csvfile, delimiter=',')
+        for row in spamreader:
+            k = row[0]
+            v = float(row[1])
+            token_list.append(k)
+            attn_list.append(v)
+
+    # read candidate tokens to dict
+    candidate_token_dict = {}
+    #print(candidate_token_path + file + "_candidate_tokenized.csv")
+    with open(candidate_tok_file, newline='', encoding="utf-8") as csvfile:
+        spamreader = csv.reader(csvfile, delimiter=',')
+        for row in spamreader:
+            k = row[0]
+            v = row[1][2:-2].split("', '")
+            candidate_token_dict[k] = v
+    return file
 
 def truncate_seq_pair(tokens_a, tokens_b, max_num_tokens, rng):
     """Truncates a pair of sequences to a maximum sequence length."""
@@ -478,7 +647,7 @@ def prep_document(document, max_sequence_length):
 
 
 #### STEP 8 ####
-def step8(bertemb,nounModel,lang):
+def step8(bertemb,nounModel,lang, pool=None, container='npy', dtype='float32'):
     global language
     language = lang
 
@@ -521,56 +690,10 @@ def step8(bertemb,nounModel,lang):
 
     print(DATASET_NAME, 'docs:', len(files))
 
-    # run all files
-    for n, file in enumerate(files):
-
-        if os.path.exists(os.path.join(save_path , file + '_candidate_embedding.csv')):
-            print('already')
-            continue
-
-        text = ''
-        my_file = os.path.join(DOCS_FOLDER , file + '.txt')  # text_path +
-        # print(my_file)
-        with open(my_file, "r",encoding="utf-8") as f:
-            for line in f:
-                if line:
-                    print(text)
-                    text += line
-        # print(text)
-        text = text.replace('$$$$$$', ' ')
-
-        candidates = NounModel.generate_candidates(text)
-        # Si no hay candidatos (None o lista vacía), saltar este fichero
-        if not candidates:
-            print(f"[STEP 8] Sin candidatos para {file}, se salta este fichero.")
-            continue
-
-        #print('Candidates total',candidates)
-        rows = []
-
-        # w1 = csv.writer(open(save_path + file + '_candidate_embedding.csv', "a"))
-
-        # get raw embedding
-        candidates_with_embeddings = bertemb(
-            candidates)  # embeddign_generation('bert-base-uncased',candidates)#bert(candidates)  # this bert handle [list of candidates]
-        for c, can_with_word_embed in enumerate(candidates_with_embeddings):
-            can_words = candidates[c]  # important
-            can_word_raw_embeddings = can_with_word_embed[1]
-            # w1.writerow([can_words, can_word_raw_embeddings])
-            rows.append([can_words, can_word_raw_embeddings])
-
-        write_csv_file(os.path.join(save_path , file + '_candidate_embedding.csv'), rows)
-        # get df
-        tf_dict = {}
-
-        for item in candidates:
-            item = item.lower()
-            if item in tf_dict.keys():
-                tf_dict[item] += 1
-            else:
-                tf_dict[item] = 1
-
-        for k, v in sorted(tf_dict.items(), key=lambda item: item[1], reverse=True):
+    # run all files; df_dict es el unico estado compartido entre documentos y se une aqui
+    step = partial(step8_file, container=container, dtype=dtype)
+    for n, (file, doc_candidates) in enumerate(map_documents(pool, step, files)):
+        for k in doc_candidates:
             if k in df_dict.keys():
                 df_dict[k] += 1
             else:
@@ -608,6 +731,57 @@ def step8(bertemb,nounModel,lang):
     write_csv_file(os.path.join(save_path_tfdf , DATASET_NAME + '_candidate_df.csv'), rows)
 
 
+def step8_file(file, container='npy', dtype='float32'):
+    """
+    Embeddings de los candidatos de un documento; devuelve sus candidatos distintos para el df.
+    'npy': una matriz (palabras, dim) por candidato en un blob con indice de candidatos; 'csv': repr en csv.
+    """
+    save_path = os.path.join(PROCESSED_FOLDER ,'candidate_embedding/')
+
+    if os.path.exists(os.path.join(save_path , file + '_candidate_embedding.csv')) or \
+            os.path.exists(os.path.join(save_path , file + '_candidate_embedding.npy')):
+        print('already')
+        return file, []
+
+    candidates = document_candidates(file)['candidates']
+    # Si no hay candidatos (None o lista vacía), saltar este fichero
+    if not candidates:
+        print(f"[STEP 8] Sin candidatos para {file}, se salta este fichero.")
+        return file, []
+
+    #print('Candidates total',candidates)
+    rows = []
+
+    # w1 = csv.writer(open(save_path + file + '_candidate_embedding.csv', "a"))
+
+    # get raw embedding
+    candidates_with_embeddings = ModelEmb(
+        candidates)  # embeddign_generation('bert-base-uncased',candidates)#bert(candidates)  # this bert handle [list of candidates]
+    for c, can_with_word_embed in enumerate(candidates_with_embeddings):
+        can_words = candidates[c]  # important
+        can_word_raw_embeddings = can_with_word_embed[1]
+        # w1.writerow([can_words, can_word_raw_embeddings])
+        rows.append([can_words, can_word_raw_embeddings])
+
+    if container == 'npy':
+        write_array_store(os.path.join(save_path , file + '_candidate_embedding'),
+                          [np.asarray(row[1], dtype=dtype) for row in rows],
+                          {'candidates': [row[0] for row in rows]}, dtype)
+    else:
+        write_csv_file(os.path.join(save_path , file + '_candidate_embedding.csv'), rows)
+    # get df
+    tf_dict = {}
+
+    for item in candidates:
+        item = item.lower()
+        if item in tf_dict.keys():
+            tf_dict[item] += 1
+        else:
+            tf_dict[item] = 1
+
+    return file, [k for k, v in sorted(tf_dict.items(), key=lambda item: item[1], reverse=True)]
+
+
 # step8(bertemb)
 
 lang='es'
@@ -619,10 +793,14 @@ get document word embedding by sentences
 """
 
 
-def step9(bertemb):
+def step9(bertemb, pool=None, container='npy', dtype='float32', lang=None):
     """
         Doc embedding
+        Con lang, las stopwords y puntuacion del step 10 se quitan al escribir.
     """
+    global ModelEmb
+    ModelEmb = bertemb
+
     start_time = time.time()
 
     problem_files = []
@@ -636,37 +814,35 @@ def step9(bertemb):
 
     print('docs:', len(files), files)
 
-    for n, file in enumerate(files):
-        #print(file)
-        fp = open(os.path.join(DOCS_FOLDER , file + '.txt'),encoding="utf-8")
-        # print("hola", fp.read().split('$$$$$$'))
-        # print(fp.read())
-        # sentences = [a for a in fp.read().split('$$$$$$')]
-        # sentences = fp.read().split('$$$$$$')
-        text = fp.read()
+    filter_words = filter_word_set(lang) if lang else None
+    step = partial(step9_file, container=container, dtype=dtype, filter_words=filter_words)
+    for n, file in enumerate(map_documents(pool, step, files)):
+        print(n + 1, "th file", file, "running time", time.time() - start_time)
 
-        sentences = separate_sentences(text)
 
-        save_path = os.path.join(PROCESSED_FOLDER , 'doc_word_embed_by_sen',  file )
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
-        else:
-            print('already')
-            continue
+def step9_file(file, container='npy', dtype='float32', filter_words=None):
+    #print(file)
+    fp = open(os.path.join(DOCS_FOLDER , file + '.txt'),encoding="utf-8")
+    # print("hola", fp.read().split('$$$$$$'))
+    # print(fp.read())
+    # sentences = [a for a in fp.read().split('$$$$$$')]
+    # sentences = fp.read().split('$$$$$$')
+    text = fp.read()
 
-        sentences_with_embeddings = bertemb(
-            sentences)  # embeddign_generation('bert-base-uncased',sentences)#bert(sentences)  # this bert handle [list of sentences]
+    sentences = separate_sentences(text)
+
+    save_path = os.path.join(PROCESSED_FOLDER , 'doc_word_embed_by_sen',  file )
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+    else:
+        print('already')
+        return file
 
-        for l, sentence_with_embeddings in enumerate(sentences_with_embeddings):
-            words = sentence_with_embeddings[0]
-            # print(words)
-            embeddings = sentence_with_embeddings[1]
-            #print(save_path + file + '_sentence' + str(l) + '_word_embeddings.csv')
-            w0 = csv.writer(open(os.path.join(save_path , file + '_sen' + str(l) + '_word_embedd.csv'), "a",encoding="utf-8",newline=''))
-            for i in range(len(words)):
-                w0.writerow([words[i], embeddings[i]])
+    sentences_with_embeddings = ModelEmb(
+        sentences)  # embeddign_generation('bert-base-uncased',sentences)#bert(sentences)  # this bert handle [list of sentences]
 
-        print(n + 1, "th file", file, "running time", time.time() - start_time)
+    save_sentence_embeddings(file, sentences_with_embeddings, container, dtype, filter_words)
+    return file
 
 
 # step9(bertemb)
@@ -681,16 +857,22 @@ def cosine_similarity(x, y, norm=False):
 
 
 def self_attn_matrix(embedding_set):
+    import torch
+    from torch import nn
     ls = np.shape(embedding_set)[0]
     # print(embedding_set)
 
     #Q = torch.tensor(embedding_set)
-    # Paso intermedio: convertir a un solo ndarray
-    embedding_array = np.array(embedding_set)
-    # Luego convertir a tensor
-    Q = torch.tensor(embedding_array)
-    K = torch.tensor(embedding_array)
-    V = torch.tensor(embedding_array)
+    if torch.is_tensor(embedding_set):
+        # ya convertido (frases cacheadas o salida de cross_attn_matrix)
+        Q = K = V = embedding_set
+    else:
+        # Paso intermedio: convertir a un solo ndarray
+        embedding_array = np.array(embedding_set)
+        # Luego convertir a tensor
+        Q = torch.tensor(embedding_array)
+        K = torch.tensor(embedding_array)
+        V = torch.tensor(embedding_array)
     # embedding_set.detach().c
 
     attn = torch.matmul(Q, K.transpose(-1, -2))
@@ -701,11 +883,23 @@ def self_attn_matrix(embedding_set):
     return V
 
 
+def sentence_tensors(all_sentences_word_embedding):
+    """
+    Convierte una sola vez por documento las frases del step 10 en tensores (n, d).
+    Las frases sin palabras se omiten: fallaban en cross_attn_matrix para todos los candidatos.
+    """
+    import torch
+    return [torch.tensor(np.array(s)) for s in all_sentences_word_embedding if len(s)]
+
+
 def cross_attn_matrix(D, Q):
-    embedding_D = np.array(D)
-    embedding_Q = np.array(Q)
-    D = torch.tensor(embedding_D)
-    Q = torch.tensor(embedding_Q)
+    import torch
+    from torch import nn
+    # D puede venir ya convertido por sentence_tensors; solo la parte de la query se rehace
+    if not torch.is_tensor(D):
+        D = torch.tensor(np.array(D))
+    if not torch.is_tensor(Q):
+        Q = torch.tensor(np.array(Q))
     attn = torch.matmul(D, Q.transpose(-1, -2))
     S_d2q = nn.Softmax(dim=1)(attn)  # S_d2q : softmax the row; shape[len(doc), len(query)]
     S_q2d = nn.Softmax(dim=0)(attn)  # S_q2d : softmax the col; shape[len(doc), len(query)]
@@ -716,6 +910,125 @@ def cross_attn_matrix(D, Q):
     return V
 
 
+# Tensores float64 de tamano [C, S, Lmax, d] vivos a la vez en masked_cross_attn y masked_self_attn:
+# A_d2q, A_q2d, los dos productos, la suma, V/4, attn@V y V*mask
+STEP10_LIVE_TENSORS = 8
+
+
+def step10_max_elements(memory_mb):
+    """Elementos por tensor [C, S, Lmax, d] para que el pico del step 10 por lotes quede en memory_mb"""
+    return max(1, memory_mb * 2 ** 20 // (8 * STEP10_LIVE_TENSORS))
+
+
+def pad_embedding_sets(embedding_sets):
+    """
+    Rellena con ceros una lista de conjuntos de vectores (n_i, d) en un tensor [N, Lmax, d]
+    y devuelve tambien la mascara [N, Lmax] de posiciones reales.
+    """
+    import torch
+    lengths = [len(e) for e in embedding_sets]
+    dim = len(next(e for e in embedding_sets if len(e))[0])
+    padded = torch.zeros((len(embedding_sets), max(lengths), dim), dtype=torch.float64)
+    mask = torch.zeros((len(embedding_sets), max(lengths)), dtype=torch.bool)
+    for i, e in enumerate(embedding_sets):
+        if lengths[i]:
+            padded[i, :lengths[i]] = torch.from_numpy(np.asarray(np.array(e), dtype=np.float64))
+            mask[i, :lengths[i]] = True
+    return padded, mask
+
+
+def masked_self_attn(V, mask):
+    """
+    self_attn_matrix por lotes: V [..., L, d] con mascara [..., L] -> [..., d].
+    Las posiciones de relleno no se atienden ni entran en la media.
+    """
+    import torch
+    attn = torch.matmul(V, V.transpose(-1, -2))
+    attn = attn.masked_fill(~mask.unsqueeze(-2), float('-inf'))
+    attn = torch.softmax(attn, dim=-1)
+    V = torch.matmul(attn, V)
+    V = (V * mask.unsqueeze(-1)).sum(dim=-2)
+    return V / mask.sum(dim=-1, keepdim=True)
+
+
+def masked_cross_attn(D, D_mask, Q, Q_mask):
+    """
+    cross_attn_matrix para todos los pares candidato/frase:
+    D [S, L, d] y Q [C, q, d] -> V [C, S, L, d]
+    """
+    import torch
+    attn = torch.einsum('sld,cqd->cslq', D, Q)
+    S_d2q = torch.softmax(attn.masked_fill(~Q_mask[:, None, None, :], float('-inf')), dim=-1)
+    S_q2d = torch.softmax(attn.masked_fill(~D_mask[None, :, :, None], float('-inf')), dim=-2)
+    A_d2q = torch.einsum('cslq,cqd->csld', S_d2q, Q)
+    A_q2d = torch.matmul(S_d2q, torch.einsum('cslq,sld->csqd', S_q2d, D))
+    D = D.unsqueeze(0)
+    V = (D + A_d2q + torch.mul(D, A_d2q) + torch.mul(D, A_q2d))
+    return V / 4
+
+
+def rank_candidates_batched(querys_name_set, querys_embedding_set, all_sentences_word_embedding, memory_mb=512):
+    """
+    Puntuacion del step 10 con tensores rellenos: frases [S, Lmax, d] y candidatos [C, Qmax, d].
+    Los candidatos se procesan en bloques para que el pico de memoria quede en unos memory_mb
+    (al menos un candidato por bloque).
+    Sin ninguna frase valida todos los candidatos se saltan y se devuelve un dict vacio, como la version por bucles.
+    """
+    import torch
+    # las frases sin palabras fallaban en cross_attn_matrix y se descartaban
+    sentences = [s for s in all_sentences_word_embedding if len(s)]
+    if len(sentences) == 0:
+        # cada candidato se salta (el continue original) y el csv del documento se escribe vacio
+        return {}
+    D, D_mask = pad_embedding_sets(sentences)
+    candidates = [w for w in range(len(querys_embedding_set)) if len(querys_embedding_set[w])]
+
+    chunk = max(1, step10_max_elements(memory_mb) // D.numel())
+    ranking_dict = {}
+    for start in tqdm(range(0, len(candidates), chunk)):
+        block = candidates[start:start + chunk]
+        Q, Q_mask = pad_embedding_sets([querys_embedding_set[w] for w in block])
+        query_inner_attn = masked_self_attn(Q, Q_mask)  # shape = (C, 768)
+
+        cross_attn = masked_cross_attn(D, D_mask, Q, Q_mask)  # shape = (C, S, L, 768)
+        sentence_embedding = masked_self_attn(cross_attn, D_mask.expand(len(block), -1, -1))  # shape = (C, S, 768)
+        doc_inner_attn = masked_self_attn(sentence_embedding,
+                                          torch.ones(sentence_embedding.shape[:2], dtype=torch.bool))  # shape = (C, 768)
+
+        output = torch.sum(query_inner_attn * doc_inner_attn, dim=-1) / (
+            torch.sqrt(torch.sum(query_inner_attn * query_inner_attn, dim=-1)) *
+            torch.sqrt(torch.sum(doc_inner_attn * doc_inner_attn, dim=-1)))
+        for w, value in zip(block, output.tolist()):
+            ranking_dict[querys_name_set[w]] = float(value)
+    return ranking_dict
+
+
+def rank_candidates_loop(querys_name_set, querys_embedding_set, all_sentences_word_embedding):
+    """
+    Puntuacion original del step 10, candidato a candidato y frase a frase.
+    Las frases se convierten a tensor una vez por documento; por candidato solo se calcula la parte de la query.
+    """
+    import torch
+    sentences = sentence_tensors(all_sentences_word_embedding)
+    if len(sentences) == 0:
+        return {}
+    ranking_dict = {}
+    for w in tqdm(range(len(querys_embedding_set))):
+        query = torch.tensor(np.array(querys_embedding_set[w]))
+        query_inner_attn = self_attn_matrix(query)  # shape = len(query words)*786
+
+        sentence_embedding_set = []
+        for sentence_word_embeddings in sentences:  # ex. (19, n, 768)
+            cross_attn = cross_attn_matrix(sentence_word_embeddings, query)
+            sentence_embedding = self_attn_matrix(cross_attn)  # shape = (n, 768)
+            sentence_embedding_set.append(sentence_embedding)  # shape = (1, 768)
+        doc_inner_attn = torch.stack(sentence_embedding_set, dim=0)  # shape = (19, 768)
+        doc_inner_attn = self_attn_matrix(doc_inner_attn)  # shape = (1, 768)
+        output = cosine_similarity(query_inner_attn.cpu().numpy(), doc_inner_attn.cpu().numpy())
+        ranking_dict[querys_name_set[w]] = float(output)
+    return ranking_dict
+
+
 def f1(a, b):
     return a * b * 2 / (a + b)
 
@@ -750,29 +1063,86 @@ def mean_f_p_r(actual, predicted, best=10, pr_plot=False):
         return np.mean(list_f1), np.mean(list_p), np.mean(list_r)
 
 
-def step10(language):
+def load_sentence_embeddings(embedding_path, file, filter_words):
+    """
+    Embeddings por palabra de cada frase del step 9 desde el blob npy, sin parsear texto.
+    Misma estructura que el csv: por frase, la lista de vectores de las palabras no filtradas.
+    """
+    index, matrices = load_array_store(os.path.join(embedding_path, file + '_word_embedd'))
+    all_sentences_word_embedding = []
+    for words, matrix in zip(index['words'], matrices):
+        # float64 como los valores que devolvia el parseo del csv
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if index.get('filtered'):
+            # ya filtrado al escribir en el step 9
+            all_sentences_word_embedding.append(list(matrix))
+        else:
+            all_sentences_word_embedding.append([matrix[i] for i, k in enumerate(words) if k not in filter_words])
+    return all_sentences_word_embedding
+
+
+def load_sentence_embeddings_csv(embedding_path, filter_words):
+    sentence_files = os.listdir(embedding_path)  # get sentence list
+    # print(sentence_files)
+    all_sentences_word_embedding = []
+    for sentence_file in sentence_files:  # do not need to sort
+        sentence_word_embedding = []
+        # print(embedding_path + sentence_file)
+        with open(os.path.join(embedding_path , sentence_file), newline='',encoding="utf-8") as csvfile:
+            spamreader = csv.reader(csvfile, delimiter=',')
+            for row in spamreader:
+                # print(row[1])
+                value_list = row[1][1:-1]
+                if value_list[0] == ' ':
+                    value_list = value_list[1:]
+                if value_list[-1] == ' ':
+                    value_list = value_list[:-1]
+                value_list = value_list.replace('\n', '').replace('  ', ' ').replace('  ', ' ').split(' ')
+                # print(sentence_file, value_list)
+                k = row[0]
+                if k not in filter_words:
+                    temp_list = []
+                    for item in value_list:
+                        if item != '':
+                            temp_list.append(float(item))
+                    v = np.array(temp_list)
+                    sentence_word_embedding.append(v)
+        all_sentences_word_embedding.append(sentence_word_embedding)
+    return all_sentences_word_embedding
+
+
+def load_candidate_embeddings(candidate_emb_base):
+    """Nombres de los candidatos del step 8 y la lista de vectores de sus palabras desde el blob npy"""
+    index, matrices = load_array_store(candidate_emb_base)
+    querys_embedding_set = [list(np.asarray(matrix, dtype=np.float64)) for matrix in matrices]
+    return index['candidates'], querys_embedding_set
+
+
+def load_candidate_embeddings_csv(candidate_emb_file):
+    querys_name_set = []
+    querys_embedding_set = []
+    with open(candidate_emb_file, newline='',encoding="utf-8") as csvfile:
+        spamreader = csv.reader(csvfile, delimiter=',')
+        for row in spamreader:
+            k = row[0]
+            v = row[1].replace('\n', ' ').replace('  ', ' ').replace('  ', ' ').replace('  ', ' ')
+            v = v.replace(', dtype=float32', '')[9:-3].split(']), array([')
+            candidate_embeddings_set = []
+            for l in range(len(v)):
+                candidate_embeddings_set.append(np.array([float(item) for item in v[l].split(', ')]))
+            querys_name_set.append(k)
+            querys_embedding_set.append(candidate_embeddings_set)
+            # print(k, candidate_embeddings_set)
+    return querys_name_set, querys_embedding_set
+
+
+def step10(language, pool=None, engine='batched', memory_mb=512):
     #language='es'
     """
     Crossed attention step
     """
-    punctuations = []
-
-    for punc in range(len(punctuation)):
-        punctuations.append(punctuation[punc])
-    if language =='es':
-        stop_words_list = stopwords.words('spanish')
-    else:
-        stop_words_list = stopwords.words('english')
-    maxInt = sys.maxsize
-
-    while True:
-        # decrease the maxInt value by factor 10
-        # as long as the OverflowError occurs.
-        try:
-            csv.field_size_limit(maxInt)
-            break
-        except OverflowError:
-            maxInt = int(maxInt / 10)
+    filter_words = filter_word_set(language)
+    set_csv_field_size_limit()
 
     start_time = time.time()
 
@@ -788,93 +1158,53 @@ def step10(language):
     files = get_files_from_path(DOCS_FOLDER)
     files = get_files_ids(files)
 
-        # run all files
-    for n, file in enumerate(files):
-
-        # doc embedding set
-        embedding_path = os.path.join(PROCESSED_FOLDER, 'doc_word_embed_by_sen' , file )
-        if not os.path.exists(embedding_path):
-            print(f"[STEP 10] No doc_word_embed_by_sen para {file}, se salta este fichero.")
-            continue
-        sentence_files = os.listdir(embedding_path)  # get sentence list
-        # print(sentence_files)
-        all_sentences_word_embedding = []
-        for sentence_file in sentence_files:  # do not need to sort
-            sentence_word_embedding = []
-            # print(embedding_path + sentence_file)
-            with open(os.path.join(embedding_path , sentence_file), newline='',encoding="utf-8") as csvfile:
-                spamreader = csv.reader(csvfile, delimiter=',')
-                for row in spamreader:
-                    # print(row[1])
-                    value_list = row[1][1:-1]
-                    if value_list[0] == ' ':
-                        value_list = value_list[1:]
-                    if value_list[-1] == ' ':
-                        value_list = value_list[:-1]
-                    value_list = value_list.replace('\n', '').replace('  ', ' ').replace('  ', ' ').split(' ')
-                    # print(sentence_file, value_list)
-                    k = row[0]
-                    if k not in stop_words_list + punctuations:
-                        temp_list = []
-                        for item in value_list:
-                            if item != '':
-                                temp_list.append(float(item))
-                        v = np.array(temp_list)
-                        sentence_word_embedding.append(v)
-            all_sentences_word_embedding.append(sentence_word_embedding)
-
-        # print(all_sentences_word_embedding)
-        # print('----')
-        # print(np.shape(all_sentences_word_embedding))  # sentence number ex. 19
-        # print(np.shape(all_sentences_word_embedding[0]))  # sentence 0 words number ex. (51,768)
-
-                # get querys embeddings path
-        querys_name_set = []
-        querys_embedding_set = []
-        querys_embeddings_path = os.path.join(PROCESSED_FOLDER, 'candidate_embedding')
-        candidate_emb_file = os.path.join(querys_embeddings_path , file + "_candidate_embedding.csv")
-        if not os.path.exists(candidate_emb_file):
-            print(f"[STEP 10] No candidate_embedding para {file}, se salta este fichero.")
-            continue
-        with open(candidate_emb_file, newline='',encoding="utf-8") as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=',')
-            for row in spamreader:
-                k = row[0]
-                v = row[1].replace('\n', ' ').replace('  ', ' ').replace('  ', ' ').replace('  ', ' ')
-                v = v.replace(', dtype=float32', '')[9:-3].split(']), array([')
-                candidate_embeddings_set = []
-                for l in range(len(v)):
-                    candidate_embeddings_set.append(np.array([float(item) for item in v[l].split(', ')]))
-                querys_name_set.append(k)
-                querys_embedding_set.append(candidate_embeddings_set)
-                # print(k, candidate_embeddings_set)
-
-        # main
-        ranking_dict = {}
-        for w in tqdm(range(len(querys_embedding_set))):
-            query_inner_attn = self_attn_matrix(querys_embedding_set[w])  # shape = len(query words)*786
-
-            sentence_embedding_set = []
-            for sentence_word_embeddings in all_sentences_word_embedding:  # ex. (19, n, 768)
-                # print(sentence_word_embeddings)
-                try:
-                    cross_attn = cross_attn_matrix(sentence_word_embeddings, querys_embedding_set[w])
-                    sentence_embedding = self_attn_matrix(cross_attn)  # shape = (n, 768)
-                    sentence_embedding_set.append(sentence_embedding)  # shape = (1, 768)
-                except:
-                    print('error')
-            if len(sentence_embedding_set)==0:
-                continue
-            doc_inner_attn = torch.stack(sentence_embedding_set, dim=0)  # shape = (19, 768)
-            doc_inner_attn = self_attn_matrix(doc_inner_attn)  # shape = (1, 768)
-            output = cosine_similarity(query_inner_attn.cpu().numpy(), doc_inner_attn.cpu().numpy())
-            ranking_dict[querys_name_set[w]] = float(output)
-        #print(ranking_dict)
-        w0 = csv.writer(open(os.path.join(save_path , file + '_candidate_cross_attn_value.csv'), "a",encoding="utf-8",newline=''))
-        for k, v in sorted(ranking_dict.items(), key=lambda item: item[1], reverse=True):
-            # print(k,v)
-            w0.writerow([k, v])
+    # run all files
+    step = partial(step10_file, filter_words=filter_words, engine=engine, memory_mb=memory_mb)
+    for n, file in enumerate(map_documents(pool, step, files)):
         crt_time = time.time()
         print(n + 1, "th file", "running time", crt_time - start_time)
 
+
+def step10_file(file, filter_words, engine='batched', memory_mb=512):
+    save_path = os.path.join(PROCESSED_FOLDER, 'candidate_cross_attn_value')
+
+    # doc embedding set
+    embedding_path = os.path.join(PROCESSED_FOLDER, 'doc_word_embed_by_sen' , file )
+    if not os.path.exists(embedding_path):
+        print(f"[STEP 10] No doc_word_embed_by_sen para {file}, se salta este fichero.")
+        return file
+    if os.path.exists(os.path.join(embedding_path, file + '_word_embedd.npy')):
+        all_sentences_word_embedding = load_sentence_embeddings(embedding_path, file, filter_words)
+    else:
+        all_sentences_word_embedding = load_sentence_embeddings_csv(embedding_path, filter_words)
+
+    # print(all_sentences_word_embedding)
+    # print('----')
+    # print(np.shape(all_sentences_word_embedding))  # sentence number ex. 19
+    # print(np.shape(all_sentences_word_embedding[0]))  # sentence 0 words number ex. (51,768)
+
+    # get querys embeddings path
+    querys_embeddings_path = os.path.join(PROCESSED_FOLDER, 'candidate_embedding')
+    candidate_emb_base = os.path.join(querys_embeddings_path , file + "_candidate_embedding")
+    if os.path.exists(candidate_emb_base + ".npy"):
+        querys_name_set, querys_embedding_set = load_candidate_embeddings(candidate_emb_base)
+    elif os.path.exists(candidate_emb_base + ".csv"):
+        querys_name_set, querys_embedding_set = load_candidate_embeddings_csv(candidate_emb_base + ".csv")
+    else:
+        print(f"[STEP 10] No candidate_embedding para {file}, se salta este fichero.")
+        return file
+
+    # main
+    if engine == 'loop':
+        ranking_dict = rank_candidates_loop(querys_name_set, querys_embedding_set, all_sentences_word_embedding)
+    else:
+        ranking_dict = rank_candidates_batched(querys_name_set, querys_embedding_set, all_sentences_word_embedding,
+                                               memory_mb)
+    #print(ranking_dict)
+    w0 = csv.writer(open(os.path.join(save_path , file + '_candidate_cross_attn_value.csv'), "a",encoding="utf-8",newline=''))
+    for k, v in sorted(ranking_dict.items(), key=lambda item: item[1], reverse=True):
+        # print(k,v)
+        w0.writerow([k, v])
+    return file
+
 # step10()
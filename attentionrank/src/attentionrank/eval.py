@@ -3,8 +3,7 @@ import numpy as np
 import os
 import time
 
-from .attentions import  clean_folder
-from .utils import write_list_file,get_files_from_path,get_files_ids
+from .utils import clean_folder, write_list_file,get_files_from_path,get_files_ids
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -84,10 +83,10 @@ def generate_results( language, f1_top=10):
 
     if language =='es':
         stopwords_file = os.path.join(BASE_DIR, "UGIR_stopwords_es.txt")
-        mystopwords = read_term_list_file(stopwords_file)
+        mystopwords = frozenset(read_term_list_file(stopwords_file))
     else:
         stopwords_file = os.path.join(BASE_DIR, "UGIR_stopwords.txt")
-        mystopwords = read_term_list_file(stopwords_file)
+        mystopwords = frozenset(read_term_list_file(stopwords_file))
 
     dataset = DATASET_NAME
     #text_path = os.path.join(datasetpath,"docsutf8") # datasetpath + '/docsutf8/'
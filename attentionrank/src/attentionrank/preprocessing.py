@@ -1,18 +1,15 @@
 import pickle
-from .utils import clean_folder
+from .utils import clean_folder, write_array_store, ensure_nltk_resource
 import numpy
-from transformers import BertTokenizer, TFBertModel
 import json
 import os
-import nltk
-from nltk.tokenize import sent_tokenize
+import csv
+from string import punctuation
+from functools import lru_cache
 import shutil
 
 #### STEP 1-4 ####.  #### PABLO VERSION
 
-nltk.download('punkt')
-
-
 
 # Variables globales (valores iniciales)
 DATASET_NAME = "default_dataset"
@@ -22,6 +19,36 @@ PROCESSED_FOLDER = os.path.join(ROOT_FOLDER, f"processed_{DATASET_NAME}")
 lang='es'
 model_type=''
 
+# Extraccion por lotes (batch_size=1 mantiene el modo frase a frase)
+batch_size = 1
+max_batch_tokens = 8192
+batch_docs = 8
+
+# Almacenamiento de atenciones: 'full' (todas las capas), 'layers' (solo attn_layers)
+# o 'colsum' (por capa, suma de heads de las columnas de la atencion normalizada por filas)
+attn_storage = 'layers'
+attn_layers = (-1,)
+attn_dtype = 'float32'
+# Contenedor por documento: 'npy' (blob memmap + indice json) o 'pkl' (pickle + volcado .txt)
+attn_format = 'npy'
+# fused: los embeddings por frase del step 9 se guardan en la misma pasada que las atenciones
+fused = False
+# Formato de los embeddings por frase: 'npy' (blob + indice) o 'csv'
+embedding_format = 'npy'
+embedding_dtype = 'float32'
+
+
+@lru_cache(maxsize=None)
+def filter_word_set(language):
+    """
+    Stopwords de nltk y signos de puntuacion que no entran en el step 10, como frozenset.
+    Se calcula una vez por idioma y lo comparten la escritura del step 9 y la lectura del step 10.
+    """
+    ensure_nltk_resource('corpora/stopwords', 'stopwords')
+    from nltk.corpus import stopwords
+    stop_words_list = stopwords.words('spanish' if language == 'es' else 'english')
+    return frozenset(stop_words_list) | frozenset(punctuation)
+
 
 
 def update_paths_preprocessing(dataset_name):
@@ -35,6 +62,37 @@ def update_paths_preprocessing(dataset_name):
 
 
 
+def column_attention(layer_attn):
+    """
+    Atencion acumulada de una capa (heads, L, L): cada fila se normaliza, se suman las
+    columnas de cada head y despues los heads. Devuelve un vector de longitud L.
+    """
+    attn = numpy.asarray(layer_attn, dtype=numpy.float32)
+    attn = attn / attn.sum(axis=-1, keepdims=True)
+    return attn.sum(axis=-2).sum(axis=0)
+
+
+def compact_attention(features):
+    """Reduce el mapa (capas, heads, L, L) de una frase a lo que indica attn_storage"""
+    attns = features['attns']
+    if attn_storage == 'full':
+        features['attns'] = attns.astype(attn_dtype, copy=False)
+        return features
+
+    num_layers = attns.shape[0]
+    layers = [layer % num_layers for layer in attn_layers]
+    compact = {
+        'tokens': features['tokens'],
+        'layers': layers,
+        'num_layers': num_layers,
+    }
+    if attn_storage == 'colsum':
+        compact['colsum'] = numpy.stack([column_attention(attns[layer]) for layer in layers]).astype(attn_dtype)
+    else:
+        compact['attns'] = attns[layers].astype(attn_dtype)
+    return compact
+
+
 def process_sentence(sentence):
 
 
@@ -56,10 +114,62 @@ def process_sentence(sentence):
         'attns': array_map,
     }
 
-    feature_dicts_with_attn = dictionary
+    feature_dicts_with_attn = compact_attention(dictionary)
     return feature_dicts_with_attn
 
 
+def make_length_batches(lengths, size, max_tokens):
+    """
+    Agrupa los indices de las frases ordenados por longitud en lotes de como mucho
+    `size` frases cuyo tamano con padding (frases * longitud maxima) no supere `max_tokens`.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current = []
+    longest = 0
+    for i in order:
+        new_longest = max(longest, lengths[i])
+        if current and (len(current) >= size or new_longest * (len(current) + 1) > max_tokens):
+            batches.append(current)
+            current = []
+            new_longest = lengths[i]
+        current.append(i)
+        longest = new_longest
+    if current:
+        batches.append(current)
+    return batches
+
+
+def process_sentences_batched(sentences):
+    """
+    Version por lotes de process_sentence: rellena las frases (de uno o varios documentos)
+    en lotes agrupados por longitud, hace una pasada por lote y separa de nuevo los mapas
+    de atencion de cada frase recortando el padding. Devuelve los resultados en el orden de entrada.
+    En modo fused cada resultado lleva tambien en 'embedding' las palabras y embeddings de la
+    frase (los del step 9) sacados del last_hidden_state de la misma pasada.
+    """
+    results = [None] * len(sentences)
+    lengths = ModelEmb.count_tokens(sentences)
+    for batch in make_length_batches(lengths, batch_size, max_batch_tokens):
+        output, encoded_input, real_lengths = ModelEmb.forwardBatch([sentences[i] for i in batch])
+        attentions = [mapa.detach().cpu().numpy() for mapa in output.attentions]
+        hidden = output.last_hidden_state.detach().cpu().numpy() if fused else None
+        input_ids = encoded_input['input_ids']
+        for b, i in enumerate(batch):
+            length = real_lengths[b]
+            # (capas, heads, L, L) igual que en process_sentence
+            array_map = numpy.stack([mapa[b, :, :length, :length] for mapa in attentions])
+            ids = input_ids[b][:length].tolist()
+            tokens = ModelEmb.tokenizer.convert_ids_to_tokens(ids)
+            results[i] = compact_attention({
+                'tokens': tokens,
+                'attns': array_map,
+            })
+            if fused:
+                results[i]['embedding'] = ModelEmb.construct_embeddings([(ids, hidden[b, :length])])[0]
+    return results
+
+
 def dividir_frases(lista_frases):
     nuevas_frases = []
     for frase in lista_frases:
@@ -79,34 +189,40 @@ def dividir_frases(lista_frases):
 
 
 def separate_sentences(text):
+    ensure_nltk_resource('tokenizers/punkt', 'punkt')
+    from nltk.tokenize import sent_tokenize
 
     # Tokenización de la oración en frases
     if lang=='es':
         sentences = sent_tokenize(text, language='spanish')
         sentences= dividir_frases(sentences)
     else:
-        sentences = nltk.sent_tokenize(text)
+        sentences = sent_tokenize(text)
     return sentences
 
 
-def preprocess_file( file_name):
-    file_identifier = file_name[:-4]
+def already_processed(file_name):
+    save_path = os.path.join(PROCESSED_FOLDER, 'sentence_paired_text')
+    base = os.path.join(save_path , file_name[:-4] + '_orgbert_attn')
+    return os.path.exists(base + '.npy') or os.path.exists(base + '.pkl')
 
 
+def read_sentences(file_name):
     file_path = os.path.join(DOCS_FOLDER , file_name ) #root_folder + 'docsutf8/' + file_name  # './SemEval2017/docsutf8/S0010938X1500195X.txt'
-    output_path = PROCESSED_FOLDER #root_folder + '/processed_' + dataset_name + '/'
-    save_path = os.path.join(output_path, 'sentence_paired_text'  ) # output_path + 'sentence_paired_text/'
-
-
-    if os.path.exists(os.path.join(save_path , file_identifier + '_orgbert_attn.pkl')):
-        print('already')
-        return
     # READ THE FILE
     with open(file_path, 'r',encoding="utf-8" ) as file:
         text = file.read().replace('\n', '')
 
     # SEPARATE INTO SENTENCES
-    sentences = separate_sentences(text)
+    return separate_sentences(text)
+
+
+def preprocess_file( file_name):
+    if already_processed(file_name):
+        print('already')
+        return
+
+    sentences = read_sentences(file_name)
 
     feature_dicts_with_attn = []
 
@@ -114,12 +230,93 @@ def preprocess_file( file_name):
         feature_dicts_with_attn_sent = process_sentence(sentence)
         feature_dicts_with_attn.append(feature_dicts_with_attn_sent)
 
+    save_attentions(file_name, feature_dicts_with_attn)
+
+
+def preprocess_files(file_names):
+    """Steps 1-4 por lotes: junta las frases de varios documentos y las extrae en lotes"""
+    pending = []
+    for file_name in file_names:
+        if already_processed(file_name):
+            print('already')
+            continue
+        pending.append((file_name, read_sentences(file_name)))
+    if not pending:
+        return
+
+    all_sentences = [sentence for _, sentences in pending for sentence in sentences]
+    feature_dicts = process_sentences_batched(all_sentences)
+
+    start = 0
+    for file_name, sentences in pending:
+        doc_features = feature_dicts[start:start + len(sentences)]
+        if fused:
+            save_sentence_embeddings(file_name[:-4], [features.pop('embedding') for features in doc_features],
+                                     embedding_format, embedding_dtype, filter_word_set(lang))
+        save_attentions(file_name, doc_features)
+        start += len(sentences)
+
+
+def save_sentence_embeddings(file_identifier, sentences_with_embeddings, container='npy', dtype='float32',
+                             filter_words=None):
+    """
+    Escribe los embeddings por palabra de cada frase en doc_word_embed_by_sen (salida del step 9).
+    'npy': una matriz (palabras, dim) por frase en un blob con indice de palabras; 'csv': un csv por frase.
+    Con filter_words las filas de esas palabras se quitan aqui con una mascara y no se guardan.
+    """
+    save_path = os.path.join(PROCESSED_FOLDER , 'doc_word_embed_by_sen',  file_identifier )
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    if filter_words is not None:
+        filtered = []
+        for sentence_words, sentence_embeddings in sentences_with_embeddings:
+            keep = [w not in filter_words for w in sentence_words]
+            sentence_embeddings = numpy.asarray(sentence_embeddings)
+            if len(sentence_embeddings):
+                sentence_embeddings = sentence_embeddings[numpy.array(keep, dtype=bool)]
+            filtered.append(([w for w, k in zip(sentence_words, keep) if k], sentence_embeddings))
+        sentences_with_embeddings = filtered
+
+    if container == 'npy':
+        words = [list(sentence_with_embeddings[0]) for sentence_with_embeddings in sentences_with_embeddings]
+        matrices = [numpy.asarray(sentence_with_embeddings[1], dtype=dtype) for sentence_with_embeddings in sentences_with_embeddings]
+        write_array_store(os.path.join(save_path, file_identifier + '_word_embedd'), matrices,
+                          {'words': words, 'filtered': filter_words is not None}, dtype)
+        return
+
+    for l, sentence_with_embeddings in enumerate(sentences_with_embeddings):
+        words = sentence_with_embeddings[0]
+        embeddings = sentence_with_embeddings[1]
+        with open(os.path.join(save_path , file_identifier + '_sen' + str(l) + '_word_embedd.csv'), "a",encoding="utf-8",newline='') as outfile:
+            w0 = csv.writer(outfile)
+            for i in range(len(words)):
+                w0.writerow([words[i], embeddings[i]])
 
 
+def save_attentions(file_name, feature_dicts_with_attn):
+    file_identifier = file_name[:-4]
+    save_path = os.path.join(PROCESSED_FOLDER, 'sentence_paired_text'  ) # output_path + 'sentence_paired_text/'
+
     if not os.path.exists(save_path):
         os.makedirs(save_path)
 
-    pickle.dump(feature_dicts_with_attn, open(os.path.join(save_path , file_identifier + '_orgbert_attn.pkl'), 'wb'))
+    if attn_format == 'npy':
+        # Un blob .npy por documento con todas las frases y un indice json con tokens y offsets
+        key = 'colsum' if attn_storage == 'colsum' else 'attns'
+        index = {
+            'tokens': [features['tokens'] for features in feature_dicts_with_attn],
+            'key': key,
+        }
+        if feature_dicts_with_attn and 'layers' in feature_dicts_with_attn[0]:
+            index['layers'] = feature_dicts_with_attn[0]['layers']
+            index['num_layers'] = feature_dicts_with_attn[0]['num_layers']
+        write_array_store(os.path.join(save_path, file_identifier + '_orgbert_attn'),
+                          [features[key] for features in feature_dicts_with_attn], index, attn_dtype)
+        return
+
+    with open(os.path.join(save_path , file_identifier + '_orgbert_attn.pkl'), 'wb') as outfile:
+        pickle.dump(feature_dicts_with_attn, outfile, pickle.HIGHEST_PROTOCOL)
 
     with open(os.path.join(save_path , file_identifier + "_sentence_paired.txt"), "w",encoding="utf-8") as outfile:
         outfile.write(str(feature_dicts_with_attn))
@@ -140,7 +337,9 @@ def preprocess_file( file_name):
         outfile.write(json_object)
 
 
-def preprocessing_module( bertemb, type,lan):
+def preprocessing_module( bertemb, type,lan, batch=1, max_tokens=8192, docs=8,
+                          storage='layers', layers=(-1,), dtype='float32', container='npy', fused_embeddings=False,
+                          emb_container='npy', emb_dtype='float32'):
 
     global ModelEmb
     ModelEmb=bertemb
@@ -150,6 +349,23 @@ def preprocessing_module( bertemb, type,lan):
     global lang
     lang=lan
 
+    global batch_size, max_batch_tokens, batch_docs
+    batch_size = batch
+    max_batch_tokens = max_tokens
+    batch_docs = docs
+
+    global attn_storage, attn_layers, attn_dtype
+    attn_storage = storage
+    attn_layers = tuple(layers)
+    attn_dtype = dtype
+    global attn_format
+    attn_format = container
+    global fused
+    fused = fused_embeddings
+    global embedding_format, embedding_dtype
+    embedding_format = emb_container
+    embedding_dtype = emb_dtype
+
     reading_path = DOCS_FOLDER#os.path.join(root_folder, 'docsutf8') #root_folder + 'docsutf8/'
     processing_path = PROCESSED_FOLDER#os.path.join(root_folder, 'processed_' + dataset_name ) #root_folder + 'processed_' + dataset_name + '/'
     if not os.path.exists(reading_path):
@@ -165,6 +381,14 @@ def preprocessing_module( bertemb, type,lan):
         os.makedirs(processing_path)
 
     files = os.listdir(reading_path)
+    if batch_size > 1 or fused:
+        files = [fi for fi in files if fi.endswith('.txt')]
+        for start in range(0, len(files), batch_docs):
+            group = files[start:start + batch_docs]
+            print('Processing files: ' + ', '.join(group))
+            preprocess_files(group)
+        return
+
     for fi in files:
         print('Processing file: ' + fi)
         if fi.endswith('.txt'):
@@ -5,8 +5,9 @@ import six
 import json
 import pickle
 import time
+from functools import lru_cache
 
-import tensorflow as tf
+import numpy as np
 
 
 def get_files_ids(files):
@@ -70,29 +71,80 @@ def convert_to_unicode(text):
 
 
 def load_json(path):
-    with tf.io.gfile.GFile(path, 'r') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 
 def write_json(o, path):
-    tf.io.gfile.makedirs(path.rsplit('/', 1)[0])
-    with tf.io.gfile.GFile(path, 'w') as f:
+    if '/' in path:
+        os.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
         json.dump(o, f)
 
 
 def load_pickle(path):
-    with tf.io.gfile.GFile(path, 'rb') as f:
+    with open(path, 'rb') as f:
         return pickle.load(f)
 
 
 def write_pickle(o, path):
     if '/' in path:
-        tf.io.gfile.makedirs(path.rsplit('/', 1)[0])
+        os.makedirs(path.rsplit('/', 1)[0], exist_ok=True)
         print(path)
-    with tf.io.gfile.GFile(path, 'wb') as f:
+    with open(path, 'wb') as f:
         pickle.dump(o, f, -1)
 
 
+@lru_cache(maxsize=None)
+def ensure_nltk_resource(resource, package):
+    """
+    Comprueba que el recurso de nltk (p. ej. 'tokenizers/punkt') esta instalado en local y solo
+    si falta descarga el paquete. Se llama al usarlo, no al importar el modulo.
+    """
+    import nltk
+    try:
+        nltk.data.find(resource)
+    except LookupError:
+        nltk.download(package, quiet=True)
+
+
+def write_array_store(path, arrays, index, dtype='float32'):
+    """
+    Guarda una lista de arrays de distinta forma en un unico blob plano path + '.npy'.
+    Los offsets y formas de cada array se guardan junto con `index` en path + '.json'.
+    """
+    offsets = []
+    shapes = []
+    total = 0
+    for array in arrays:
+        offsets.append(total)
+        shapes.append(list(array.shape))
+        total += array.size
+    blob = np.empty(total, dtype=dtype)
+    for array, offset in zip(arrays, offsets):
+        blob[offset:offset + array.size] = np.ravel(array)
+    np.save(path + '.npy', blob)
+
+    index = dict(index, offsets=offsets, shapes=shapes)
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+
+def load_array_store(path):
+    """
+    Abre un blob de write_array_store en modo memmap. Devuelve el indice y una vista
+    (sin copia ni lectura previa del fichero) de cada array guardado.
+    """
+    with open(path + '.json', 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    blob = np.load(path + '.npy', mmap_mode='r')
+    arrays = []
+    for offset, shape in zip(index['offsets'], index['shapes']):
+        size = int(np.prod(shape))
+        arrays.append(blob[offset:offset + size].reshape(shape))
+    return index, arrays
+
+
 def logged_loop(iterable, n=None, **kwargs):
     if n is None:
         n = len(iterable)
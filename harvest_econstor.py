@@ -3,8 +3,16 @@ import argparse
 import json
 import time
 import re
+import os
+import queue
+import threading
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional
 
@@ -37,15 +45,62 @@ def dedup_case_insensitive(items: List[str]) -> List[str]:
             seen.add(k); out.append(x.strip())
     return out
 
+# Caracteres que re.IGNORECASE iguala a i/s pero que str.lower() no convierte en ellos (İ, ı, ſ)
+_FOLD_SPECIAL = frozenset("\u0130\u0131\u017f")
+# Caracteres no ASCII que admite _re_ascii_term; no tienen mayúscula/minúscula
+_FOLD_SAFE_EXTRA = frozenset("–")
+
+@lru_cache(maxsize=8192)
 def keyword_boundary_pattern(term: str) -> re.Pattern:
     t = re.escape(term.strip()).replace(r"\ ", r"\s+")
     return re.compile(rf"(?<!\w){t}(?!\w)", flags=re.IGNORECASE)
 
+@lru_cache(maxsize=8192)
+def normalized_keyword(term: str) -> Optional[str]:
+    """
+    Keyword en minúsculas para buscarla con str.find en el texto normalizado, o None si solo
+    keyword_boundary_pattern respeta su semántica (espacios dobles o tabs, caracteres no ASCII).
+    """
+    t = term.strip()
+    if t.split() != t.split(" "):
+        return None
+    if not all(c.isascii() or c in _FOLD_SAFE_EXTRA for c in t):
+        return None
+    return t.lower()
+
+def normalize_text(text: str) -> Optional[str]:
+    """
+    Texto en minúsculas con cada tramo de espacios reducido a uno, para que un espacio de la
+    keyword equivalga al \\s+ del regex. None si contiene caracteres que IGNORECASE trata distinto.
+    """
+    if not _FOLD_SPECIAL.isdisjoint(text):
+        return None
+    return " ".join(text.lower().split())
+
+def _is_word(ch: str) -> bool:
+    # equivale a \w de re en str
+    return ch.isalnum() or ch == "_"
+
+def keyword_in_text(term: str, text: str, normalized: Optional[str]) -> bool:
+    key = normalized_keyword(term) if normalized is not None else None
+    if key is None:
+        return keyword_boundary_pattern(term).search(text) is not None
+    i = normalized.find(key)
+    while i != -1:
+        end = i + len(key)
+        if (i == 0 or not _is_word(normalized[i - 1])) and (end == len(normalized) or not _is_word(normalized[end])):
+            return True
+        i = normalized.find(key, i + 1)
+    return False
+
 def filter_keywords_present_in_text(keywords: List[str], text: str) -> List[str]:
-    present = []
-    for kw in keywords:
-        if keyword_boundary_pattern(kw).search(text):
-            present.append(kw.strip())
+    """
+    Keywords que aparecen en el texto como palabra completa, sin distinguir mayúsculas y con
+    cualquier espacio entre palabras. El texto se normaliza una vez y cada keyword se busca con
+    str.find; los casos que la normalización no cubre usan el regex (compilado con caché LRU).
+    """
+    normalized = normalize_text(text)
+    present = [kw.strip() for kw in keywords if keyword_in_text(kw, text, normalized)]
     return dedup_case_insensitive(present)
 
 def pick_english_text(nodes: List[ET.Element]) -> Optional[str]:
@@ -63,30 +118,181 @@ def pick_english_text(nodes: List[ET.Element]) -> Optional[str]:
     return best
 
 # --- OAI-PMH ---
-def list_records(metadata_prefix="oai_dc", from_date=None, until_date=None, set_spec=None, sleep=0.4):
-    """Generador de registros OAI con manejo de resumptionToken."""
+OAI_RECORD = f"{{{NS['oai']}}}record"
+OAI_LIST_RECORDS = f"{{{NS['oai']}}}ListRecords"
+OAI_TOKEN = f"{{{NS['oai']}}}resumptionToken"
+OAI_ERROR = f"{{{NS['oai']}}}error"
+
+class OAIError(Exception):
+    """Error OAI-PMH del servidor (<error code="...">, con HTTP 200): no se reintenta."""
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+
+def make_session(pool_size: int = 4) -> requests.Session:
+    """Sesión HTTP con pool de conexiones: las páginas reutilizan la conexión TCP/TLS."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+class RateLimiter:
+    """Límite global de peticiones por segundo compartido por todos los cursores."""
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class HarvestMeter:
+    """Contadores de peticiones, páginas, registros y bytes parseados para el modo benchmark."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = self.retries = self.pages = self.records = self.bytes = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                setattr(self, key, getattr(self, key) + value)
+
+METER = HarvestMeter()
+
+class CountingStream:
+    """Envuelve el cuerpo de la respuesta y cuenta los bytes que lee iterparse."""
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes = 0
+
+    def read(self, n=-1):
+        data = self.raw.read(n)
+        self.bytes += len(data)
+        return data
+
+def iter_page_records(stream, page: Dict):
+    """
+    Parsea una página OAI en streaming con iterparse: devuelve cada oai:record al cerrarse y lo
+    libera al pedir el siguiente, así la memoria por página no depende de su tamaño.
+    El resumptionToken de la página se deja en page["token"]. Un oai:error lanza OAIError,
+    salvo noRecordsMatch, que es una página vacía (las ventanas de fechas sin registros).
+    """
+    parent = None
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if elem.tag == OAI_LIST_RECORDS:
+                parent = elem
+            continue
+        if elem.tag == OAI_RECORD:
+            yield elem
+            elem.clear()
+            if parent is not None:
+                parent.clear()
+        elif elem.tag == OAI_TOKEN:
+            page["token"] = (elem.text or "").strip() or None
+        elif elem.tag == OAI_ERROR:
+            code = elem.get("code", "")
+            if code != "noRecordsMatch":
+                # p. ej. badResumptionToken: el token caducó y la cosecha no puede seguir desde él
+                raise OAIError(code, (elem.text or "").strip())
+
+# Errores HTTP que se reintentan; el resto (400, 404...) se propagan
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+
+def retry_after_seconds(response) -> Optional[float]:
+    """Espera pedida por el servidor (OAI-PMH suele responder 503 + Retry-After)."""
+    value = response.headers.get("Retry-After", "") if response is not None else ""
+    return float(value) if value.strip().isdigit() else None
+
+def fetch_page_records(session: requests.Session, page_params: Dict, page: Dict,
+                       retries: int = 5, backoff: float = 2.0, max_backoff: float = 120.0,
+                       limiter: Optional[RateLimiter] = None):
+    """
+    Registros de una página con reintentos y espera exponencial ante errores transitorios
+    (conexión, timeout, cuerpo cortado, 429/5xx). Si la página falla a mitad, al repetirla se
+    saltan los registros ya devueltos.
+    """
+    done = 0
+    attempt = 0
+    while True:
+        page["token"] = None
+        if limiter is not None:
+            limiter.wait()
+        METER.add(requests=1)
+        stream = None
+        try:
+            with session.get(OAI_BASE, params=page_params, timeout=40, stream=True) as r:
+                r.raise_for_status()
+                # el cuerpo se descomprime y se parsea a medida que llega
+                r.raw.decode_content = True
+                stream = CountingStream(r.raw)
+                for i, rec in enumerate(iter_page_records(stream, page)):
+                    if i < done:
+                        continue
+                    METER.add(records=1)
+                    yield rec
+                    done += 1
+            METER.add(pages=1)
+            return
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in TRANSIENT_STATUS:
+                raise
+            error, wait = e, retry_after_seconds(e.response)
+        except (OSError, ET.ParseError, urllib3.exceptions.HTTPError) as e:
+            error, wait = e, None
+        finally:
+            if stream is not None:
+                METER.add(bytes=stream.bytes)
+
+        if attempt >= retries:
+            raise error
+        if wait is None:
+            wait = min(backoff * 2 ** attempt, max_backoff)
+        attempt += 1
+        METER.add(retries=1)
+        print(f"⚠️  {type(error).__name__}: {error} — reintento {attempt}/{retries} en {wait:.1f}s")
+        time.sleep(wait)
+
+def list_records(metadata_prefix="oai_dc", from_date=None, until_date=None, set_spec=None, sleep=0.4,
+                 session: Optional[requests.Session] = None, resumption_token: Optional[str] = None,
+                 on_page=None, retries: int = 5, backoff: float = 2.0, limiter: Optional[RateLimiter] = None):
+    """
+    Generador de registros OAI con manejo de resumptionToken.
+    Con resumption_token se continúa desde esa página. on_page(token) se llama cuando se han
+    consumido todos los registros de una página, con el token de la siguiente (None al acabar).
+    Con limiter el ritmo lo marca el límite global en vez del sleep fijo entre páginas.
+    """
     params = {"verb": "ListRecords", "metadataPrefix": metadata_prefix}
     if from_date: params["from"] = from_date
     if until_date: params["until"] = until_date
     if set_spec: params["set"] = set_spec
+    session = session or make_session()
 
-    token = None
+    token = resumption_token
     while True:
         if token:
-            r = requests.get(OAI_BASE, params={"verb":"ListRecords","resumptionToken":token}, timeout=40)
+            page_params = {"verb":"ListRecords","resumptionToken":token}
         else:
-            r = requests.get(OAI_BASE, params=params, timeout=40)
-        r.raise_for_status()
-        root = ET.fromstring(r.text)
-
-        for rec in root.findall(".//oai:record", NS):
-            yield rec
+            page_params = params
+        page = {"token": None}
+        yield from fetch_page_records(session, page_params, page, retries, backoff, limiter=limiter)
 
-        rt = root.find(".//oai:resumptionToken", NS)
-        token = (rt.text or "").strip() if rt is not None else None
+        token = page["token"]
+        if on_page is not None:
+            on_page(token)
         if not token:
             break
-        time.sleep(sleep)
+        if limiter is None:
+            time.sleep(sleep)
 
 # --- Extracción de campos Dublin Core ---
 def get_dc_list(meta, tag) -> List[ET.Element]:
@@ -123,6 +329,178 @@ def extract_fields(rec) -> Dict:
         "lang_ok": lang_ok
     }
 
+# --- Filtros ---
+def new_stats() -> Dict:
+    return {"no_title":0,"lang_filtered":0,"short_text":0,"no_keywords":0,"no_kw_in_text":0,"min_kws":0}
+
+def filter_record(fields: Dict, stats: Dict, min_text_chars: int = 150, min_kws_present: int = 1,
+                  multiword_only: bool = True, require_kw_in_text: bool = True) -> Optional[Dict]:
+    """Documento JSONL de un registro, o None si se descarta (el motivo se cuenta en stats)."""
+    title = fields.get("title")
+    if not title:
+        stats["no_title"] += 1
+        return None
+    if not fields.get("lang_ok", True):
+        stats["lang_filtered"] += 1
+        return None
+
+    abstract = fields.get("abstract")
+    text = title if not abstract else f"{title} — {abstract}"
+    if len(text) < min_text_chars:
+        stats["short_text"] += 1
+        return None
+
+    # keywords limpias (en inglés y multi-palabra si se exige)
+    kws = [k for k in fields.get("keywords", []) if is_english_keyword(k, multiword_only)]
+    kws = dedup_case_insensitive(kws)
+    if not kws:
+        stats["no_keywords"] += 1
+        return None
+
+    if require_kw_in_text:
+        kws = filter_keywords_present_in_text(kws, text)
+        if not kws:
+            stats["no_kw_in_text"] += 1
+            return None
+
+    if len(kws) < min_kws_present:
+        stats["min_kws"] += 1
+        return None
+
+    return {"doc_id": fields["id"], "text": text, "keywords": sorted(kws, key=str.lower)}
+
+# --- Cosecha concurrente por ventanas de fechas ---
+def earliest_datestamp(session: requests.Session) -> str:
+    """Primera fecha del repositorio según el verbo Identify."""
+    r = session.get(OAI_BASE, params={"verb": "Identify"}, timeout=40)
+    r.raise_for_status()
+    node = ET.fromstring(r.content).find(".//oai:earliestDatestamp", NS)
+    return (node.text or "").strip()[:10]
+
+def date_windows(from_date: str, until_date: str, days: int) -> List[tuple]:
+    """Ventanas [from, until] disjuntas de `days` días (from/until de OAI-PMH son inclusivos)."""
+    start, end = date.fromisoformat(from_date), date.fromisoformat(until_date)
+    windows = []
+    while start <= end:
+        stop = min(start + timedelta(days=days - 1), end)
+        windows.append((start.isoformat(), stop.isoformat()))
+        start = stop + timedelta(days=1)
+    return windows
+
+def harvest_window(window: tuple, session: requests.Session, limiter: RateLimiter, pages: queue.Queue,
+                   stop: threading.Event, retries: int = 5, backoff: float = 2.0):
+    """Cursor OAI de una ventana: parsea cada página y manda sus campos a la cola del escritor."""
+    batch = []
+    def on_page(token):
+        if batch:
+            pages.put(list(batch))
+            batch.clear()
+    try:
+        if stop.is_set():
+            return
+        for rec in list_records(metadata_prefix="oai_dc", from_date=window[0], until_date=window[1],
+                                session=session, on_page=on_page, retries=retries, backoff=backoff,
+                                limiter=limiter):
+            if stop.is_set():
+                return
+            batch.append(extract_fields(rec))
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        # fin de ventana: el escritor cuenta cuántas quedan
+        pages.put(None)
+
+def harvest_econstor_windows(out_path: str,
+                             from_date: Optional[str] = None,
+                             until_date: Optional[str] = None,
+                             window_days: int = 30,
+                             workers: int = 4,
+                             rate: float = 2.5,
+                             max_records: int = 8000,
+                             min_text_chars: int = 150,
+                             min_kws_present: int = 1,
+                             multiword_only: bool = True,
+                             require_kw_in_text: bool = True,
+                             retries: int = 5,
+                             backoff: float = 2.0):
+    """
+    Cosecha el rango de fechas partido en ventanas, con `workers` cursores concurrentes y como
+    máximo `rate` peticiones por segundo entre todos. Los cursores solo descargan y parsean; el
+    filtrado y la escritura se hacen en este hilo, alimentado por una cola de páginas.
+    El orden de salida depende de qué ventana responda antes. Sin checkpoint.
+    """
+    out = Path(out_path)
+    kept = 0
+    stats = new_stats()
+    stats["duplicates"] = 0
+    seen = set()
+
+    with make_session(pool_size=workers) as session, out.open("w", encoding="utf-8") as f:
+        from_date = from_date or earliest_datestamp(session)
+        until_date = until_date or date.today().isoformat()
+        windows = date_windows(from_date, until_date, window_days)
+        print(f"{len(windows)} ventanas de {window_days} días entre {from_date} y {until_date}, "
+              f"{workers} cursores, {rate} peticiones/s")
+
+        limiter = RateLimiter(rate)
+        # cola acotada: si el escritor se retrasa, los cursores esperan en vez de acumular páginas
+        pages = queue.Queue(maxsize=workers * 4)
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(harvest_window, w, session, limiter, pages, stop, retries, backoff)
+                       for w in windows]
+            pending = len(windows)
+            try:
+                while pending:
+                    batch = pages.get()
+                    if batch is None:
+                        pending -= 1
+                        continue
+                    if stop.is_set():
+                        continue
+                    for fields in batch:
+                        # un registro modificado durante la cosecha puede cambiar de ventana
+                        if fields.get("id") in seen:
+                            stats["duplicates"] += 1
+                            continue
+                        seen.add(fields.get("id"))
+                        doc = filter_record(fields, stats, min_text_chars, min_kws_present,
+                                            multiword_only, require_kw_in_text)
+                        if doc is None:
+                            continue
+                        f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+                        kept += 1
+                        if kept >= max_records:
+                            stop.set()
+                            break
+            except BaseException:
+                # si el escritor falla, los cursores quedarían bloqueados en la cola llena y el
+                # pool esperaría para siempre: se paran y se vacía la cola hasta el None de cada ventana
+                stop.set()
+                while pending:
+                    if pages.get() is None:
+                        pending -= 1
+                raise
+            for future in futures:
+                future.result()
+
+    return kept, stats
+
+# --- Checkpoint ---
+def load_checkpoint(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    with path.open(encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(path: Path, state: Dict):
+    """Escritura atómica: un corte a mitad no deja un checkpoint corrupto."""
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
 # --- Pipeline principal ---
 def harvest_econstor(out_path: str,
                      max_records: int = 8000,
@@ -130,48 +508,57 @@ def harvest_econstor(out_path: str,
                      min_kws_present: int = 1,
                      multiword_only: bool = True,
                      require_kw_in_text: bool = True,
-                     sleep: float = 0.4):
+                     sleep: float = 0.4,
+                     checkpoint_path: Optional[str] = None,
+                     resume: bool = False,
+                     retries: int = 5,
+                     backoff: float = 2.0,
+                     from_date: Optional[str] = None,
+                     until_date: Optional[str] = None):
+    """
+    Cosecha a JSONL. Al terminar cada página se guarda en el checkpoint el token de la siguiente,
+    kept, stats y el tamaño del JSONL; con resume se trunca el JSONL a ese tamaño (descarta lo
+    escrito de la página a medias) y se sigue desde el token.
+    """
     out = Path(out_path)
-    out.unlink(missing_ok=True)
+    checkpoint = Path(checkpoint_path or out_path + ".checkpoint.json")
 
     kept = 0
-    stats = {"no_title":0,"lang_filtered":0,"short_text":0,"no_keywords":0,"no_kw_in_text":0,"min_kws":0}
-
-    with out.open("w", encoding="utf-8") as f:
-        for rec in list_records(metadata_prefix="oai_dc", sleep=sleep):
-            fields = extract_fields(rec)
-            title = fields.get("title")
-            if not title:
-                stats["no_title"] += 1
-                continue
-            if not fields.get("lang_ok", True):
-                stats["lang_filtered"] += 1
-                continue
+    stats = new_stats()
+    token = None
 
-            abstract = fields.get("abstract")
-            text = title if not abstract else f"{title} — {abstract}"
-            if len(text) < min_text_chars:
-                stats["short_text"] += 1
-                continue
+    state = load_checkpoint(checkpoint) if resume else None
+    if state is not None:
+        if state.get("done"):
+            print(f"La cosecha de {checkpoint} ya estaba terminada.")
+            return state["kept"], state["stats"]
+        kept, stats, token = state["kept"], state["stats"], state["token"]
+        # truncar un JSONL que no existe o es más corto lo rellenaría con bytes nulos
+        size = out.stat().st_size if out.exists() else None
+        if size is None or size < state["offset"]:
+            raise RuntimeError(f"No se puede reanudar: el checkpoint {checkpoint} espera {state['offset']} bytes "
+                               f"en {out}, pero " + ("no existe" if size is None else f"tiene {size}"))
+        with out.open("ab") as f:
+            f.truncate(state["offset"])
+        print(f"Reanudando con {kept} documentos guardados (token {token})")
+    else:
+        if resume:
+            print(f"No hay checkpoint en {checkpoint}; se empieza desde el principio.")
+        out.unlink(missing_ok=True)
+        checkpoint.unlink(missing_ok=True)
 
-            # keywords limpias (en inglés y multi-palabra si se exige)
-            kws = [k for k in fields.get("keywords", []) if is_english_keyword(k, multiword_only)]
-            kws = dedup_case_insensitive(kws)
-            if not kws:
-                stats["no_keywords"] += 1
-                continue
+    with make_session() as session, out.open("a", encoding="utf-8") as f:
+        def on_page(next_token):
+            f.flush()
+            save_checkpoint(checkpoint, {"token": next_token, "kept": kept, "stats": stats,
+                                         "offset": out.stat().st_size, "done": next_token is None})
 
-            if require_kw_in_text:
-                kws = filter_keywords_present_in_text(kws, text)
-                if not kws:
-                    stats["no_kw_in_text"] += 1
-                    continue
-
-            if len(kws) < min_kws_present:
-                stats["min_kws"] += 1
+        for rec in list_records(metadata_prefix="oai_dc", from_date=from_date, until_date=until_date,
+                                sleep=sleep, session=session, resumption_token=token, on_page=on_page, retries=retries, backoff=backoff):
+            doc = filter_record(extract_fields(rec), stats, min_text_chars, min_kws_present,
+                                multiword_only, require_kw_in_text)
+            if doc is None:
                 continue
-
-            doc = {"doc_id": fields["id"], "text": text, "keywords": sorted(kws, key=str.lower)}
             f.write(json.dumps(doc, ensure_ascii=False) + "\n")
             kept += 1
             if kept >= max_records:
@@ -179,7 +566,20 @@ def harvest_econstor(out_path: str,
 
     return kept, stats
 
+def print_summary(out_path: str, kept: int, stats: Dict):
+    print("\nResumen de descartes:")
+    for k, v in stats.items():
+        print(f"  - {k}: {v}")
+    print(f"\n✅ Guardado {kept} documentos en {out_path}")
+
+def print_benchmark(elapsed: float, kept: int):
+    m = METER
+    print(f"\n⏱️  {elapsed:.2f}s: {m.requests} peticiones ({m.retries} reintentos), {m.pages} páginas")
+    print(f"  - registros: {m.records} ({m.records / elapsed:.1f}/s), guardados {kept} ({kept / elapsed:.1f}/s)")
+    print(f"  - parseado: {m.bytes / 1e6:.2f} MB ({m.bytes / 1e6 / elapsed:.2f} MB/s)")
+
 def main():
+    global OAI_BASE
     ap = argparse.ArgumentParser("EconStor OAI-PMH harvester → JSONL (text + keywords)")
     ap.add_argument("--out", default="econstor_finance_en.jsonl")
     ap.add_argument("--max-records", type=int, default=8000)
@@ -188,22 +588,77 @@ def main():
     ap.add_argument("--multiword-only", action="store_true")
     ap.add_argument("--no-require-kw-in-text", action="store_true", help="No exigir que las keywords aparezcan en el texto")
     ap.add_argument("--sleep", type=float, default=0.4, help="Delay entre requests (educado con el servidor)")
+    ap.add_argument("--checkpoint", default=None, help="Fichero de checkpoint (por defecto <out>.checkpoint.json)")
+    ap.add_argument("--resume", action="store_true", help="Continuar una cosecha interrumpida desde su checkpoint")
+    ap.add_argument("--retries", type=int, default=5, help="Reintentos por página ante errores HTTP transitorios")
+    ap.add_argument("--backoff", type=float, default=2.0, help="Espera base en segundos, se duplica en cada reintento")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Cursores concurrentes, uno por ventana de fechas (>1 activa la cosecha por ventanas)")
+    ap.add_argument("--from", dest="from_date", default=None, help="Fecha inicial YYYY-MM-DD (por defecto la del Identify)")
+    ap.add_argument("--until", dest="until_date", default=None, help="Fecha final YYYY-MM-DD (por defecto hoy)")
+    ap.add_argument("--window-days", type=int, default=30, help="Días por ventana en la cosecha concurrente")
+    ap.add_argument("--rate", type=float, default=None,
+                    help="Máximo de peticiones por segundo entre todos los cursores (por defecto 1/--sleep)")
+    ap.add_argument("--base-url", default=OAI_BASE, help="Endpoint OAI-PMH (p. ej. el de oai_fixture_server.py)")
+    ap.add_argument("--fixture-records", type=int, default=None,
+                    help="Cosechar de un oai_fixture_server local con N registros sintéticos")
+    ap.add_argument("--fixture-jsonl", default=None, help="Cosechar de un oai_fixture_server local que sirve este JSONL")
+    ap.add_argument("--fixture-page-size", type=int, default=100, help="Registros por página del servidor local")
+    ap.add_argument("--fixture-latency", type=float, default=0.0, help="Retardo por petición del servidor local")
+    ap.add_argument("--benchmark", action="store_true",
+                    help="Informar de registros/s, bytes parseados y descartes al terminar")
     args = ap.parse_args()
+    if args.workers > 1 and args.resume:
+        ap.error("--resume solo está disponible con --workers 1")
 
-    kept, stats = harvest_econstor(
-        out_path=args.out,
-        max_records=args.max_records,
-        min_text_chars=args.min_text_chars,
-        min_kws_present=args.min_kws,
-        multiword_only=args.multiword_only,
-        require_kw_in_text=not args.no_require_kw_in_text,
-        sleep=args.sleep,
-    )
+    OAI_BASE = args.base_url
+    fixture = None
+    if args.fixture_records is not None or args.fixture_jsonl:
+        from oai_fixture_server import load_fixture_records, start_fixture_server
+        records = load_fixture_records(args.fixture_jsonl, args.fixture_records or 0)
+        fixture, OAI_BASE = start_fixture_server(records, args.fixture_page_size, args.fixture_latency)
+        print(f"Servidor OAI local con {len(records)} registros en {OAI_BASE}")
 
-    print("\nResumen de descartes:")
-    for k, v in stats.items():
-        print(f"  - {k}: {v}")
-    print(f"\n✅ Guardado {kept} documentos en {args.out}")
+    METER.reset()
+    start = time.perf_counter()
+    if args.workers > 1:
+        kept, stats = harvest_econstor_windows(
+            out_path=args.out,
+            from_date=args.from_date,
+            until_date=args.until_date,
+            window_days=args.window_days,
+            workers=args.workers,
+            rate=args.rate or (1.0 / args.sleep if args.sleep > 0 else float("inf")),
+            max_records=args.max_records,
+            min_text_chars=args.min_text_chars,
+            min_kws_present=args.min_kws,
+            multiword_only=args.multiword_only,
+            require_kw_in_text=not args.no_require_kw_in_text,
+            retries=args.retries,
+            backoff=args.backoff,
+        )
+    else:
+        kept, stats = harvest_econstor(
+            out_path=args.out,
+            max_records=args.max_records,
+            min_text_chars=args.min_text_chars,
+            min_kws_present=args.min_kws,
+            multiword_only=args.multiword_only,
+            require_kw_in_text=not args.no_require_kw_in_text,
+            sleep=args.sleep,
+            checkpoint_path=args.checkpoint,
+            resume=args.resume,
+            retries=args.retries,
+            backoff=args.backoff,
+            from_date=args.from_date,
+            until_date=args.until_date,
+        )
+    elapsed = time.perf_counter() - start
+    print_summary(args.out, kept, stats)
+    if args.benchmark:
+        print_benchmark(elapsed, kept)
+    if fixture is not None:
+        fixture.shutdown()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
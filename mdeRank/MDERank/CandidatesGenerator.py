@@ -1,9 +1,14 @@
 
 import spacy
+
+# Componentes que la extraccion de noun chunks no usa (solo hacen falta POS y dependencias)
+UNUSED_COMPONENTS = ('ner', 'lemmatizer')
+
+
 class CandidatesGenerator:
     """Represent the input text in which we want to extract keyphrases"""
 
-    def __init__(self,lang):
+    def __init__(self,lang, single_parse=True):
 
         if lang == 'en':
             self.model = spacy.load("en_core_web_sm")
@@ -11,27 +16,17 @@ class CandidatesGenerator:
             self.model = spacy.load("es_core_news_sm")
         self.keyphrase_candidate=[]
         self.lang=lang
+        # single_parse: noun chunks del Doc del documento; si no, se reanaliza cada frase por separado
+        self.single_parse = single_parse
 
 
     def generate_candidates(self,text):
 
-
-        candidates = []
         doc = self.model(text)
-        for sent in doc.sents:
-
-            doc2= self.model(sent.text)
-            print(sent.text)
-            sintagmas = [chunk.text for chunk in doc2.noun_chunks]
-            #resultado.append((sent.text.strip(), sintagmas))
-            # print(chunk.text, chunk.root.text, chunk.root.dep_, chunk.root.head.text)
-            for chunk in sintagmas:
-                print(chunk)
-                chunk_processed = remove_starting_articles(chunk,self.lang)
-                # chunk_processed = chunk_processed.lower()
-                if len(chunk_processed) < 2:
-                    continue
-                candidates.append([chunk_processed, 0])
+        if self.single_parse:
+            candidates = self.candidates_from_doc(doc)
+        else:
+            candidates = self.candidates_from_sentences([sent.text for sent in doc.sents])[0]
         '''
         self.considered_tags = {'NN', 'NNS', 'NNP', 'NNPS', 'JJ'}
 
@@ -45,10 +40,59 @@ class CandidatesGenerator:
                 self.tokens_tagged[i] = (token, "IN")
 
         '''
-        print(candidates)
 
         self.keyphrase_candidate = candidates  # extract_candidates(self.tokens_tagged, en_model)
 
+    def candidates_from_doc(self, doc):
+        """
+        Noun chunks del Doc ya analizado, frase a frase, sin volver a pasar spaCy.
+        Cada candidato es [texto, (inicio, fin)] con offsets de caracteres en el texto del documento.
+        """
+        candidates = []
+        for sent in doc.sents:
+            for chunk in sent.noun_chunks:
+                chunk_processed = remove_starting_articles(chunk.text, self.lang)
+                if len(chunk_processed) < 2:
+                    continue
+                start = chunk.end_char - len(chunk_processed)
+                candidates.append([chunk_processed, (start, chunk.end_char)])
+        return candidates
+
+    def candidates_from_sentences(self, sentences, owners=None, n_docs=1, n_process=1, batch_size=64):
+        """
+        Modo original: cada frase se analiza de nuevo y se toman sus noun chunks.
+        owners indica a que documento pertenece cada frase; devuelve [candidato, 0] por documento.
+        """
+        disable = [name for name in UNUSED_COMPONENTS if name in self.model.pipe_names]
+        owners = owners if owners is not None else [0] * len(sentences)
+        results = [[] for _ in range(n_docs)]
+        for i, doc2 in zip(owners, self.model.pipe(sentences, n_process=n_process, batch_size=batch_size, disable=disable)):
+            for chunk in doc2.noun_chunks:
+                chunk_processed = remove_starting_articles(chunk.text, self.lang)
+                # chunk_processed = chunk_processed.lower()
+                if len(chunk_processed) < 2:
+                    continue
+                results[i].append([chunk_processed, 0])
+        return results
+
+    def generate_candidates_batch(self, texts, n_process=1, batch_size=64):
+        """
+        Candidatos de varios documentos con nlp.pipe y sin los componentes que no usan los noun chunks.
+        Devuelve por documento la lista de candidatos, en el mismo orden que texts.
+        """
+        disable = [name for name in UNUSED_COMPONENTS if name in self.model.pipe_names]
+        docs = self.model.pipe(texts, n_process=n_process, batch_size=batch_size, disable=disable)
+        if self.single_parse:
+            return [self.candidates_from_doc(doc) for doc in docs]
+
+        sentences = []
+        owners = []
+        for i, doc in enumerate(docs):
+            for sent in doc.sents:
+                sentences.append(sent.text)
+                owners.append(i)
+        return self.candidates_from_sentences(sentences, owners, len(texts), n_process, batch_size)
+
 def remove_starting_articles(text,lang):
     # Lista de artículos a eliminar
     articles=[]
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class MentionIndex:
+    """
+    Posiciones de los unigramas y bigramas de ids de un documento, para buscar las apariciones
+    de los candidatos sobre los token ids sin reconstruir cadenas ni compilar regex.
+    """
+
+    def __init__(self, input_ids):
+        self.base = np.asarray(input_ids, dtype=np.int64)
+        self.ids = self.base.tolist()
+        self.unigrams = {}
+        self.bigrams = {}
+        for i, token_id in enumerate(self.ids):
+            self.unigrams.setdefault(token_id, []).append(i)
+            if i + 1 < len(self.ids):
+                self.bigrams.setdefault((token_id, self.ids[i + 1]), []).append(i)
+
+    def find(self, candidate_ids):
+        """Inicios de las apariciones no solapadas de candidate_ids, de izquierda a derecha como re.sub"""
+        k = len(candidate_ids)
+        if k == 0:
+            return []
+        if k == 1:
+            positions = self.unigrams.get(candidate_ids[0], [])
+        else:
+            positions = self.bigrams.get((candidate_ids[0], candidate_ids[1]), [])
+
+        starts = []
+        end = 0
+        for p in positions:
+            if p >= end and self.ids[p:p + k] == candidate_ids:
+                starts.append(p)
+                end = p + k
+        return starts
+
+    def masked(self, starts, length, mask_id):
+        """Copia de los ids del documento con cada aparicion sustituida por mask_id"""
+        input_ids = self.base.copy()
+        for p in starts:
+            input_ids[p:p + length] = mask_id
+        return input_ids
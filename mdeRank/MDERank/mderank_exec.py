@@ -1,20 +1,23 @@
 import re
 import time
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset
 from tqdm import tqdm
 from transformers import BertForMaskedLM, BertTokenizer, RobertaTokenizer, RobertaForMaskedLM
-from torch.utils.data import DataLoader
-import pandas as pd
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.dataloader import default_collate
 import numpy as np
 import logging
 import argparse
 import codecs
 import json
+import heapq
+import itertools
 import os
 import nltk
 import spacy
 from CandidatesGenerator import CandidatesGenerator
+from MentionIndex import MentionIndex
 
 
 
@@ -81,6 +84,35 @@ class KPE_Dataset(Dataset):
         doc_id = doc_pair[2]
 
         return [ori_example, masked_example, doc_id]
+
+
+def collate_pairs(batch):
+    """
+    Junta los pares [original, enmascarado, doc_id] recortando el relleno a la secuencia
+    mas larga del lote en vez de MAX_LEN (el relleno va a la derecha).
+    """
+    ori_doc, masked_doc, doc_id = default_collate(batch)
+    length = int(max(ori_doc["attention_mask"].sum(-1).max(), masked_doc["attention_mask"].sum(-1).max()))
+    for encode_dict in (ori_doc, masked_doc):
+        for key in ("input_ids", "token_type_ids", "attention_mask"):
+            if key in encode_dict:
+                encode_dict[key] = encode_dict[key][..., :length]
+    return [ori_doc, masked_doc, doc_id]
+
+
+class LengthGroupedSampler(Sampler):
+    """Recorre los pares ordenados por longitud real para que cada lote tenga poco relleno"""
+
+    def __init__(self, dataset):
+        lengths = [int(pair[1]["attention_mask"].sum()) for pair in dataset.docs_pairs]
+        # sorted es estable: los candidatos de un documento siguen juntos
+        self.order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return iter(self.order)
 '''
 
 
@@ -112,6 +144,72 @@ class Result:
 
 
 
+class StreamingKPE_Dataset(IterableDataset):
+    """
+    Pares [original, enmascarado, doc_id] generados documento a documento al iterar, sin
+    materializar el corpus. Los candidatos salen por bloques de chunk_size documentos con nlp.pipe
+    y list_of_names se llena con el nombre de cada documento en orden de doc_id.
+    """
+
+    def __init__(self, documents, generator, list_of_names, chunk_size=64, n_process=1):
+        self.documents = documents
+        self.generator = generator
+        self.list_of_names = list_of_names
+        self.chunk_size = chunk_size
+        self.n_process = n_process
+
+    def __iter__(self):
+        idx = 0
+        documents = iter(self.documents)
+        while True:
+            chunk = list(itertools.islice(documents, self.chunk_size))
+            if not chunk:
+                return
+            texts = [' '.join(doc.split()[:512]) for _, doc in chunk]
+            all_cans = self.generator.generate_candidates_batch(texts, self.n_process, self.chunk_size)
+            for (key, _), doc, cans in zip(chunk, texts, all_cans):
+                self.list_of_names.append(key)
+                candidates = [can.lower() for can, pos in cans]
+                doc_pairs, count = generate_absent_doc(encode_document(doc), candidates, idx)
+                idx += 1
+                for pair in doc_pairs:
+                    yield pair
+
+
+class DocTopK:
+    """
+    Los k candidatos distintos (en minusculas) de menor score de un documento, en un heap acotado
+    que se actualiza mientras se puntua: la memoria no crece con el numero de candidatos.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []  # (-score, candidato): la raiz es el peor de los k
+        self.scores = {}
+
+    def push(self, candidate, score):
+        candidate = candidate.lower()
+        if candidate in self.scores:
+            if score >= self.scores[candidate]:
+                return
+            # mismo candidato con mejor score: se sustituye su entrada
+            self.heap = [(s, c) for s, c in self.heap if c != candidate]
+            heapq.heapify(self.heap)
+            del self.scores[candidate]
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (-score, candidate))
+        elif -self.heap[0][0] > score:
+            _, worst = heapq.heapreplace(self.heap, (-score, candidate))
+            del self.scores[worst]
+        else:
+            return
+        self.scores[candidate] = score
+
+    def ranked(self):
+        """Candidatos de menor a mayor score"""
+        return [c for _, c in sorted(self.heap, key=lambda item: -item[0])]
+
+
 def write_string(s, output_path):
     with open(output_path, 'w') as output_file:
         output_file.write(s)
@@ -311,9 +409,8 @@ def get_semeval2017_data(data_path="data/SemEval2017/docsutf8",labels_path="data
     return data,labels
 
 
-def get_exec_dataset(data_path="data/exec_example"):
-
-    data={}
+def iter_exec_dataset(data_path="data/exec_example"):
+    """Documentos (nombre, texto limpio) de uno en uno, sin cargar el corpus entero"""
     for dirname, dirnames, filenames in os.walk(data_path):
         for fname in filenames:
             if not fname.endswith('.txt'):
@@ -326,9 +423,16 @@ def get_exec_dataset(data_path="data/exec_example"):
                 text = fi.read()
                 text = text.replace("%", '')
             text = clean_text(text,database="Semeval2017")
-            data[left] = text.lower()
+            yield left, text.lower()
             # f.close()
 
+
+def get_exec_dataset(data_path="data/exec_example"):
+
+    data={}
+    for left, text in iter_exec_dataset(data_path):
+        data[left] = text
+
     return data
 
 
@@ -362,29 +466,24 @@ def dedup_stem(candidates):
 
 
 
-def find_candidate_mention(tok_candidate,ori_tokens):
-
-    candidate_len = len(tok_candidate)
-    ori_doc = ' '.join(ori_tokens)
-    can_token = ' '.join(tok_candidate)
-
-    conteo = can_token.count('Ġ')
-    #print(tok_candidate,conteo)
-    if model_type == 'bert':
-        mask = ' '.join(['[MASK]'] * candidate_len)
-    else:
-        mask = ' '.join(['<mask>'] * candidate_len)
+def encode_document(doc):
+    """Documento original codificado (relleno a MAX_LEN) como entrada de generate_absent_doc"""
+    if model_type=='roberta':
+        doc=' '+doc.lower()
+    return tokenizer.encode_plus(
+        doc,  # Sentence to encode.
+        add_special_tokens=True,  # Add '[CLS]' and '[SEP]'
+        max_length=MAX_LEN,  # Pad & truncate all sentences.
+        padding='max_length',
+        return_attention_mask=True,  # Construct attn. masks.
+        return_tensors='pt',  # Return pytorch tensors.
+        truncation=True
+    )
 
 
-    candidate_re = re.compile(r"\b" + can_token + r"\b")
-
-    masked_doc = re.sub(candidate_re, mask, ori_doc)
-    match = candidate_re.findall(ori_doc)
-    #print('>', ori_doc)
-    #print('>', masked_doc)
-    #print('len match >',len(match), match)
-
-    return match,masked_doc
+def find_candidate_mention(tok_candidate, mentions):
+    """Apariciones de los tokens del candidato en los ids del documento (MentionIndex)"""
+    return mentions.find(tokenizer.convert_tokens_to_ids(tok_candidate))
 
 
 def generate_absent_doc(ori_encode_dict, candidates, idx):
@@ -393,7 +492,9 @@ def generate_absent_doc(ori_encode_dict, candidates, idx):
     count = 0
     doc_pairs = []
     ori_input_ids = ori_encode_dict["input_ids"].squeeze()
-    ori_tokens = tokenizer.convert_ids_to_tokens(ori_input_ids)
+    # indice de n-gramas de ids del documento, compartido por todos sus candidatos
+    mentions = MentionIndex(ori_input_ids.numpy())
+    len_masked_tokens = int((ori_input_ids != tokenizer.pad_token_id).sum())
 
     # There are multi candidates for a document
     for id, candidate in enumerate(candidates):
@@ -405,58 +506,31 @@ def generate_absent_doc(ori_encode_dict, candidates, idx):
 
         ####
 
-        match=[]
-        try:
-            if model_type == 'bert':
+        if model_type == 'bert':
+            tok_candidate = tokenizer.tokenize(candidate)
+            match = find_candidate_mention(tok_candidate, mentions)
+        else:
+            ## roberta
+            tok_candidate = tokenizer.tokenize(' ' + candidate)
+            match = find_candidate_mention(tok_candidate, mentions)
+            if len(match) == 0:
+                print("try again")
                 tok_candidate = tokenizer.tokenize(candidate)
-                match, masked_doc = find_candidate_mention(tok_candidate, ori_tokens)
-            else:
-                ## roberta
-                tok_candidate = tokenizer.tokenize(' ' + candidate)
-                match, masked_doc= find_candidate_mention(tok_candidate,ori_tokens)
-                if len(match) == 0:
-                    print("try again")
-                    tok_candidate = tokenizer.tokenize(candidate)
-                    match, masked_doc = find_candidate_mention(tok_candidate, ori_tokens)
-
-
-
-        except:
-            print("cannot replace: ", candidate)
-            count += 1
-            continue
+                match = find_candidate_mention(tok_candidate, mentions)
 
         if len(match) == 0:
             count +=1
-            ori_doc = ' '.join(ori_tokens)
-            can_token = ' '.join(tok_candidate)
             #print("do not find: ", candidate)
-            #print("candidate:", can_token)
-
-            #print("ori_docs: ", ori_doc)
-
             continue
 
-        masked_tokens = masked_doc.split()
-        masked_input_ids = tokenizer.convert_tokens_to_ids(masked_tokens)
-        if model_type=='bert':
-            len_masked_tokens = len(masked_tokens) - masked_tokens.count('[PAD]')
-        else:
-            len_masked_tokens = len(masked_tokens) - masked_tokens.count('<pad>')
-
-        #print('len',len_masked_tokens)
-        try:
-            assert len(masked_input_ids) == MAX_LEN
-        except:
-            count +=1
-            print("unmcatched: ", candidate)
-            continue
+        # copia de los ids originales con las apariciones enmascaradas
+        masked_input_ids = mentions.masked(match, len(tok_candidate), tokenizer.mask_token_id)
 
         masked_attention_mask = np.zeros(MAX_LEN)
         masked_attention_mask[:len_masked_tokens] = 1
         masked_token_type_ids = np.zeros(MAX_LEN)
         masked_encode_dict = {
-            "input_ids": torch.Tensor(masked_input_ids).to(torch.long),
+            "input_ids": torch.from_numpy(masked_input_ids),
             "token_type_ids": torch.Tensor(masked_token_type_ids).to(torch.long),
             "attention_mask": torch.Tensor(masked_attention_mask).to(torch.long),
             "candidate": candidate,
@@ -506,14 +580,36 @@ def cls_emebddings(model_output):
     return doc_embeddings
 
 
-def keyphrases_selection_exec(path, list_of_names,   model, dataloader, k_val , log):
-
+def doc_embeddings(model, input_ids, attention_mask, token_type_ids=None):
+    """Embedding de documento de un lote de input_ids segun doc_embed_mode"""
+    if model_type == 'bert':
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, output_hidden_states=True)
+    else:
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+    # Transformers models always output tuples.
+    # See the models docstrings for the detail of all the outputs
+    # In our case, the first element is the hidden state of the last layer of the Bert model
+    if args.doc_embed_mode == "mean":
+        return mean_pooling(outputs, attention_mask)
+    elif args.doc_embed_mode == "cls":
+        return cls_emebddings(outputs)
+    elif args.doc_embed_mode == "max":
+        return max_pooling(outputs, attention_mask)
+
+
+def rank_documents(model, dataloader, list_of_names, k_val, streaming=False):
+    """
+    Puntua los pares del dataloader y devuelve (doc_id, top-k de candidatos) para cada documento
+    de list_of_names, en orden. En streaming cada documento sale en cuanto sus pares estan puntuados.
+    """
     model.eval()
 
-    cos_similarity_list = {}
-    candidate_list = []
-    cos_score_list = []
-    doc_id_list = []
+    # top-k acotado por documento, actualizado lote a lote
+    top_k = {}
+    # documentos ya devueltos
+    written = 0
+    # embedding del documento original por doc_id
+    ori_doc_cache = {}
 
 
 
@@ -533,67 +629,52 @@ def keyphrases_selection_exec(path, list_of_names,   model, dataloader, k_val ,
         masked_attention_mask = torch.squeeze(masked_doc["attention_mask"].to('cpu'), 1)
         candidate = masked_doc["candidate"]
 
+        ori_token_type_ids = masked_token_type_ids = None
         if model_type=='bert':
             ori_token_type_ids = torch.squeeze(ori_doc["token_type_ids"].to('cpu'), 1)
             masked_token_type_ids = torch.squeeze(masked_doc["token_type_ids"].to('cpu'), 1)
 
+        # El documento original es el mismo para todos sus candidatos: se codifica una vez por doc_id
+        doc_ids = doc_id.numpy().tolist()
+        new_rows = {}
+        for row, d in enumerate(doc_ids):
+            if d not in ori_doc_cache and d not in new_rows:
+                new_rows[d] = row
+        rows = list(new_rows.values())
 
         # Predict hidden states features for each layer
         with torch.no_grad():
             # See the models docstrings for the detail of the inputs
-
-            if model_type=='bert':
-                ori_outputs = model(input_ids=ori_input_ids, attention_mask=ori_attention_mask, token_type_ids=ori_token_type_ids, output_hidden_states=True)
-                masked_outputs = model(input_ids=masked_input_ids, attention_mask=masked_attention_mask, token_type_ids=masked_token_type_ids, output_hidden_states=True)
-            else:
-                ori_outputs = model(input_ids=ori_input_ids, attention_mask=ori_attention_mask,output_hidden_states=True)
-                masked_outputs = model(input_ids=masked_input_ids, attention_mask=masked_attention_mask,output_hidden_states=True)
-            # Transformers models always output tuples.
-            # See the models docstrings for the detail of all the outputs
-            # In our case, the first element is the hidden state of the last layer of the Bert model
-            if args.doc_embed_mode == "mean":
-                ori_doc_embed =mean_pooling(ori_outputs, ori_attention_mask)
-                masked_doc_embed = mean_pooling(masked_outputs, masked_attention_mask)
-            elif  args.doc_embed_mode == "cls":
-                ori_doc_embed = cls_emebddings(ori_outputs)
-                masked_doc_embed = cls_emebddings(masked_outputs)
-            elif args.doc_embed_mode == "max":
-                ori_doc_embed = max_pooling(ori_outputs, ori_attention_mask)
-                masked_doc_embed = max_pooling(masked_outputs, masked_attention_mask)
+            if rows:
+                ori_embed = doc_embeddings(model, ori_input_ids[rows], ori_attention_mask[rows],
+                                           ori_token_type_ids[rows] if ori_token_type_ids is not None else None)
+                for d, embed in zip(new_rows, ori_embed):
+                    ori_doc_cache[d] = embed
+            ori_doc_embed = torch.stack([ori_doc_cache[d] for d in doc_ids])
+            masked_doc_embed = doc_embeddings(model, masked_input_ids, masked_attention_mask, masked_token_type_ids)
 
             cosine_similarity = torch.cosine_similarity(ori_doc_embed, masked_doc_embed, dim=1).cpu()
             score = cosine_similarity
-            doc_id_list.extend(doc_id.numpy().tolist())
-            candidate_list.extend(candidate)
-            cos_score_list.extend(score.numpy())
-
-    cos_similarity_list["doc_id"] = doc_id_list
-    cos_similarity_list["candidate"] = candidate_list
-    cos_similarity_list["score"] = cos_score_list
-    cosine_similarity_rank = pd.DataFrame(cos_similarity_list)
-
-    for i in range(len(doc_list)):
-        doc_results = cosine_similarity_rank.loc[cosine_similarity_rank['doc_id']==i]
-        ranked_keyphrases = doc_results.sort_values(by='score')
-        top_k = ranked_keyphrases.reset_index(drop = True)
-        top_k_can = top_k.loc[:, ['candidate']].values.tolist()
-        #print(top_k)
-
-        candidates_set = set()
-        candidates_dedup = []
-        for temp in top_k_can:
-            temp = temp[0].lower()
-            if temp in candidates_set:
-                continue
-            else:
-                candidates_set.add(temp)
-                candidates_dedup.append(temp)
+            for d, can, sc in zip(doc_ids, candidate, score.numpy().tolist()):
+                if d not in top_k:
+                    top_k[d] = DocTopK(k_val)
+                top_k[d].push(can, sc)
 
+        if streaming:
+            # los pares llegan en orden de documento: los anteriores al lote ya estan completos
+            while written < min(doc_ids):
+                ori_doc_cache.pop(written, None)
+                yield written, top_k.pop(written).ranked() if written in top_k else []
+                written += 1
 
-        #log.logger.info("Sorted_Candidate: {} \n".format(top_k_can))
-        #log.logger.info("Candidates_Dedup: {} \n".format(candidates_dedup))
+    while written < len(list_of_names):
+        yield written, top_k.pop(written).ranked() if written in top_k else []
+        written += 1
 
-        j = 0
+
+def keyphrases_selection_exec(path, list_of_names,   model, dataloader, k_val , log, streaming=False):
+
+    for i, candidates_dedup in rank_documents(model, dataloader, list_of_names, k_val, streaming):
         Matched = candidates_dedup[:k_val]
         Name= list_of_names[i]
         write_results( Matched,os.path.join(path,str(Name)+'.key'))
@@ -674,6 +755,20 @@ if __name__ == '__main__':
     parser.add_argument("--no_cuda",
                         action="store_true",
                         help="Whether not to use CUDA when available")
+    parser.add_argument("--spacy_processes",
+                        default=1,
+                        type=int,
+                        help="Processes for spaCy nlp.pipe candidate extraction")
+    parser.add_argument("--spacy_batch_size",
+                        default=64,
+                        type=int,
+                        help="Documents per spaCy nlp.pipe batch")
+    parser.add_argument("--streaming",
+                        action="store_true",
+                        help="Generate the masked pairs document by document and write each .key as soon as its candidates are scored")
+    parser.add_argument("--reparse_sentences",
+                        action="store_true",
+                        help="Parse every sentence again for its noun chunks instead of taking them from the document parse")
     args = parser.parse_args()
 
     start = time.time()
@@ -692,9 +787,10 @@ if __name__ == '__main__':
     porter=nltk.PorterStemmer()
 
 
-    data = get_exec_dataset(args.dataset_dir)
-    log.logger.info("Dataset")
-    log.logger.info(data)
+    if not args.streaming:
+        data = get_exec_dataset(args.dataset_dir)
+        log.logger.info("Dataset")
+        log.logger.info(data)
 
 
 
@@ -712,7 +808,7 @@ if __name__ == '__main__':
 
 
 
-    generator = CandidatesGenerator(lang)
+    generator = CandidatesGenerator(lang, not args.reparse_sentences)
 
 
 
@@ -745,57 +841,47 @@ if __name__ == '__main__':
 
     list_of_names=[]
 
-    ## EVALUATION??
-    for idx, (key, doc) in enumerate(data.items()):
-
-        doc = ' '.join(doc.split()[:512])
-        list_of_names.append(key)
-        doc_list.append(doc)
+    if args.streaming:
+        # pares generados documento a documento; cada .key se escribe al terminar su documento
+        dataset = StreamingKPE_Dataset(iter_exec_dataset(args.dataset_dir), generator, list_of_names,
+                                       args.spacy_batch_size, args.spacy_processes)
+        dataloader = DataLoader(dataset, batch_size=args.batch_size, collate_fn=collate_pairs)
+    else:
+        # Candidatos de todos los documentos en una pasada de nlp.pipe
+        texts = [' '.join(doc.split()[:512]) for doc in data.values()]
+        all_cans = generator.generate_candidates_batch(texts, args.spacy_processes, args.spacy_batch_size)
 
-        # Statistic on empty docs
-        empty_doc = 0
-        try:
-             generator.generate_candidates(doc)
-        except:
-            empty_doc += 1
-            print("doc: ", doc)
+        ## EVALUATION??
+        for idx, (key, doc) in enumerate(data.items()):
 
-        # Generate candidates (lower)
-        cans = generator.keyphrase_candidate
-        candidates = []
-        for can, pos in cans:
-            candidates.append(can.lower())
-        candidate_num += len(candidates)
+            doc = texts[idx]
+            list_of_names.append(key)
+            doc_list.append(doc)
 
-        if model_type=='roberta':
-            doc=' '+doc.lower()
-        ori_encode_dict = tokenizer.encode_plus(
-            doc,  # Sentence to encode.
-            add_special_tokens=True,  # Add '[CLS]' and '[SEP]'
-            max_length=MAX_LEN,  # Pad & truncate all sentences.
-            padding='max_length',
-            return_attention_mask=True,  # Construct attn. masks.
-            return_tensors='pt',  # Return pytorch tensors.
-            truncation=True
-        )
+            # Generate candidates (lower)
+            cans = all_cans[idx]
+            candidates = []
+            for can, pos in cans:
+                candidates.append(can.lower())
+            candidate_num += len(candidates)
 
-        doc_pairs, count = generate_absent_doc(ori_encode_dict, candidates, idx)
-        docs_pairs.extend(doc_pairs)
-        t_n +=count
+            doc_pairs, count = generate_absent_doc(encode_document(doc), candidates, idx)
+            docs_pairs.extend(doc_pairs)
+            t_n +=count
 
 
 
 
-    #print("candidate_num: ", candidate_num)
-    #print("unmatched: ", t_n)
+        #print("candidate_num: ", candidate_num)
+        #print("unmatched: ", t_n)
 
 
 
-    dataset = KPE_Dataset(docs_pairs)
-    #print("examples: ", dataset.total_examples)
-    dataloader = DataLoader(dataset, batch_size=args.batch_size)
+        dataset = KPE_Dataset(docs_pairs)
+        #print("examples: ", dataset.total_examples)
+        dataloader = DataLoader(dataset, batch_size=args.batch_size, sampler=LengthGroupedSampler(dataset), collate_fn=collate_pairs)
 
-    keyphrases_selection_exec(args.dataset_dir, list_of_names,  model, dataloader,k_val, log)
+    keyphrases_selection_exec(args.dataset_dir, list_of_names,  model, dataloader,k_val, log, args.streaming)
     end = time.time()
 
 
@@ -4,8 +4,8 @@ import torch
 from torch.utils.data import Dataset
 from tqdm import tqdm
 from transformers import BertForMaskedLM, BertTokenizer, RobertaTokenizer, RobertaForMaskedLM
-from torch.utils.data import DataLoader
-import pandas as pd
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.dataloader import default_collate
 import numpy as np
 import logging
 import argparse
@@ -14,6 +14,7 @@ import json
 import os
 import nltk
 import spacy
+from MentionIndex import MentionIndex
 
 
 
@@ -158,6 +159,35 @@ class KPE_Dataset(Dataset):
         doc_id = doc_pair[2]
 
         return [ori_example, masked_example, doc_id]
+
+
+def collate_pairs(batch):
+    """
+    Junta los pares [original, enmascarado, doc_id] recortando el relleno a la secuencia
+    mas larga del lote en vez de MAX_LEN (el relleno va a la derecha).
+    """
+    ori_doc, masked_doc, doc_id = default_collate(batch)
+    length = int(max(ori_doc["attention_mask"].sum(-1).max(), masked_doc["attention_mask"].sum(-1).max()))
+    for encode_dict in (ori_doc, masked_doc):
+        for key in ("input_ids", "token_type_ids", "attention_mask"):
+            if key in encode_dict:
+                encode_dict[key] = encode_dict[key][..., :length]
+    return [ori_doc, masked_doc, doc_id]
+
+
+class LengthGroupedSampler(Sampler):
+    """Recorre los pares ordenados por longitud real para que cada lote tenga poco relleno"""
+
+    def __init__(self, dataset):
+        lengths = [int(pair[1]["attention_mask"].sum()) for pair in dataset.docs_pairs]
+        # sorted es estable: los candidatos de un documento siguen juntos
+        self.order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        return iter(self.order)
 '''
 
 
@@ -414,29 +444,9 @@ def dedup_stem(candidates):
 
 
 
-def find_candidate_mention(tok_candidate,ori_tokens):
-
-    candidate_len = len(tok_candidate)
-    ori_doc = ' '.join(ori_tokens)
-    can_token = ' '.join(tok_candidate)
-
-    conteo = can_token.count('Ġ')
-    #print(tok_candidate,conteo)
-    if model_type == 'bert':
-        mask = ' '.join(['[MASK]'] * candidate_len)
-    else:
-        mask = ' '.join(['<mask>'] * candidate_len)
-
-
-    candidate_re = re.compile(r"\b" + can_token + r"\b")
-
-    masked_doc = re.sub(candidate_re, mask, ori_doc)
-    match = candidate_re.findall(ori_doc)
-    #print('>', ori_doc)
-    #print('>', masked_doc)
-    #print('len match >',len(match), match)
-
-    return match,masked_doc
+def find_candidate_mention(tok_candidate, mentions):
+    """Apariciones de los tokens del candidato en los ids del documento (MentionIndex)"""
+    return mentions.find(tokenizer.convert_tokens_to_ids(tok_candidate))
 
 
 def generate_absent_doc(ori_encode_dict, candidates, idx):
@@ -444,7 +454,9 @@ def generate_absent_doc(ori_encode_dict, candidates, idx):
     count = 0
     doc_pairs = []
     ori_input_ids = ori_encode_dict["input_ids"].squeeze()
-    ori_tokens = tokenizer.convert_ids_to_tokens(ori_input_ids)
+    # indice de n-gramas de ids del documento, compartido por todos sus candidatos
+    mentions = MentionIndex(ori_input_ids.numpy())
+    len_masked_tokens = int((ori_input_ids != tokenizer.pad_token_id).sum())
 
     # There are multi candidates for a document
     for id, candidate in enumerate(candidates):
@@ -456,58 +468,31 @@ def generate_absent_doc(ori_encode_dict, candidates, idx):
 
         ####
 
-        match=[]
-        try:
-            if model_type == 'bert':
+        if model_type == 'bert':
+            tok_candidate = tokenizer.tokenize(candidate)
+            match = find_candidate_mention(tok_candidate, mentions)
+        else:
+            ## roberta
+            tok_candidate = tokenizer.tokenize(' ' + candidate)
+            match = find_candidate_mention(tok_candidate, mentions)
+            if len(match) == 0:
+                print("try again")
                 tok_candidate = tokenizer.tokenize(candidate)
-                match, masked_doc = find_candidate_mention(tok_candidate, ori_tokens)
-            else:
-                ## roberta
-                tok_candidate = tokenizer.tokenize(' ' + candidate)
-                match, masked_doc= find_candidate_mention(tok_candidate,ori_tokens)
-                if len(match) == 0:
-                    print("try again")
-                    tok_candidate = tokenizer.tokenize(candidate)
-                    match, masked_doc = find_candidate_mention(tok_candidate, ori_tokens)
-
-
-
-        except:
-            print("cannot replace: ", candidate)
-            count += 1
-            continue
+                match = find_candidate_mention(tok_candidate, mentions)
 
         if len(match) == 0:
             count +=1
-            ori_doc = ' '.join(ori_tokens)
-            can_token = ' '.join(tok_candidate)
             #print("do not find: ", candidate)
-            #print("candidate:", can_token)
-
-            #print("ori_docs: ", ori_doc)
-
             continue
 
-        masked_tokens = masked_doc.split()
-        masked_input_ids = tokenizer.convert_tokens_to_ids(masked_tokens)
-        if model_type=='bert':
-            len_masked_tokens = len(masked_tokens) - masked_tokens.count('[PAD]')
-        else:
-            len_masked_tokens = len(masked_tokens) - masked_tokens.count('<pad>')
-
-        #print('len',len_masked_tokens)
-        try:
-            assert len(masked_input_ids) == MAX_LEN
-        except:
-            count +=1
-            print("unmcatched: ", candidate)
-            continue
+        # copia de los ids originales con las apariciones enmascaradas
+        masked_input_ids = mentions.masked(match, len(tok_candidate), tokenizer.mask_token_id)
 
         masked_attention_mask = np.zeros(MAX_LEN)
         masked_attention_mask[:len_masked_tokens] = 1
         masked_token_type_ids = np.zeros(MAX_LEN)
         masked_encode_dict = {
-            "input_ids": torch.Tensor(masked_input_ids).to(torch.long),
+            "input_ids": torch.from_numpy(masked_input_ids),
             "token_type_ids": torch.Tensor(masked_token_type_ids).to(torch.long),
             "attention_mask": torch.Tensor(masked_attention_mask).to(torch.long),
             "candidate": candidate,
@@ -557,14 +542,32 @@ def cls_emebddings(model_output):
     return doc_embeddings
 
 
+def doc_embeddings(model, input_ids, attention_mask, token_type_ids=None):
+    """Embedding de documento de un lote de input_ids segun doc_embed_mode"""
+    if model_type == 'bert':
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids, output_hidden_states=True)
+    else:
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=True)
+    # Transformers models always output tuples.
+    # See the models docstrings for the detail of all the outputs
+    # In our case, the first element is the hidden state of the last layer of the Bert model
+    if args.doc_embed_mode == "mean":
+        return mean_pooling(outputs, attention_mask)
+    elif args.doc_embed_mode == "cls":
+        return cls_emebddings(outputs)
+    elif args.doc_embed_mode == "max":
+        return max_pooling(outputs, attention_mask)
+
+
 def keyphrases_selection(doc_list, labels_stemed, labels,  model, dataloader, log):
 
     model.eval()
 
-    cos_similarity_list = {}
     candidate_list = []
     cos_score_list = []
     doc_id_list = []
+    # embedding del documento original por doc_id
+    ori_doc_cache = {}
 
     P = R = F1 = 0.0
     num_c_5 = num_c_10 = num_c_15 = 0
@@ -588,33 +591,29 @@ def keyphrases_selection(doc_list, labels_stemed, labels,  model, dataloader, lo
         masked_attention_mask = torch.squeeze(masked_doc["attention_mask"].to('cpu'), 1)
         candidate = masked_doc["candidate"]
 
+        ori_token_type_ids = masked_token_type_ids = None
         if model_type=='bert':
             ori_token_type_ids = torch.squeeze(ori_doc["token_type_ids"].to('cpu'), 1)
             masked_token_type_ids = torch.squeeze(masked_doc["token_type_ids"].to('cpu'), 1)
 
+        # El documento original es el mismo para todos sus candidatos: se codifica una vez por doc_id
+        doc_ids = doc_id.numpy().tolist()
+        new_rows = {}
+        for row, d in enumerate(doc_ids):
+            if d not in ori_doc_cache and d not in new_rows:
+                new_rows[d] = row
+        rows = list(new_rows.values())
 
         # Predict hidden states features for each layer
         with torch.no_grad():
             # See the models docstrings for the detail of the inputs
-
-            if model_type=='bert':
-                ori_outputs = model(input_ids=ori_input_ids, attention_mask=ori_attention_mask, token_type_ids=ori_token_type_ids, output_hidden_states=True)
-                masked_outputs = model(input_ids=masked_input_ids, attention_mask=masked_attention_mask, token_type_ids=masked_token_type_ids, output_hidden_states=True)
-            else:
-                ori_outputs = model(input_ids=ori_input_ids, attention_mask=ori_attention_mask,output_hidden_states=True)
-                masked_outputs = model(input_ids=masked_input_ids, attention_mask=masked_attention_mask,output_hidden_states=True)
-            # Transformers models always output tuples.
-            # See the models docstrings for the detail of all the outputs
-            # In our case, the first element is the hidden state of the last layer of the Bert model
-            if args.doc_embed_mode == "mean":
-                ori_doc_embed =mean_pooling(ori_outputs, ori_attention_mask)
-                masked_doc_embed = mean_pooling(masked_outputs, masked_attention_mask)
-            elif  args.doc_embed_mode == "cls":
-                ori_doc_embed = cls_emebddings(ori_outputs)
-                masked_doc_embed = cls_emebddings(masked_outputs)
-            elif args.doc_embed_mode == "max":
-                ori_doc_embed = max_pooling(ori_outputs, ori_attention_mask)
-                masked_doc_embed = max_pooling(masked_outputs, masked_attention_mask)
+            if rows:
+                ori_embed = doc_embeddings(model, ori_input_ids[rows], ori_attention_mask[rows],
+                                           ori_token_type_ids[rows] if ori_token_type_ids is not None else None)
+                for d, embed in zip(new_rows, ori_embed):
+                    ori_doc_cache[d] = embed
+            ori_doc_embed = torch.stack([ori_doc_cache[d] for d in doc_ids])
+            masked_doc_embed = doc_embeddings(model, masked_input_ids, masked_attention_mask, masked_token_type_ids)
 
             cosine_similarity = torch.cosine_similarity(ori_doc_embed, masked_doc_embed, dim=1).cpu()
             score = cosine_similarity
@@ -622,16 +621,14 @@ def keyphrases_selection(doc_list, labels_stemed, labels,  model, dataloader, lo
             candidate_list.extend(candidate)
             cos_score_list.extend(score.numpy())
 
-    cos_similarity_list["doc_id"] = doc_id_list
-    cos_similarity_list["candidate"] = candidate_list
-    cos_similarity_list["score"] = cos_score_list
-    cosine_similarity_rank = pd.DataFrame(cos_similarity_list)
+    # un solo orden por (doc_id, score): cada documento queda en un tramo contiguo
+    doc_ids = np.asarray(doc_id_list, dtype=np.int64)
+    order = np.lexsort((np.asarray(cos_score_list), doc_ids))
+    bounds = np.searchsorted(doc_ids[order], np.arange(len(doc_list) + 1))
 
     for i in range(len(doc_list)):
-        doc_results = cosine_similarity_rank.loc[cosine_similarity_rank['doc_id']==i]
-        ranked_keyphrases = doc_results.sort_values(by='score')
-        top_k = ranked_keyphrases.reset_index(drop = True)
-        top_k_can = top_k.loc[:, ['candidate']].values.tolist()
+        top_k = [candidate_list[r] for r in order[bounds[i]:bounds[i + 1]]]
+        top_k_can = [[can] for can in top_k]
         #print(top_k)
 
         candidates_set = set()
@@ -916,7 +913,7 @@ if __name__ == '__main__':
 
     dataset = KPE_Dataset(docs_pairs)
     #print("examples: ", dataset.total_examples)
-    dataloader = DataLoader(dataset, batch_size=args.batch_size)
+    dataloader = DataLoader(dataset, batch_size=args.batch_size, sampler=LengthGroupedSampler(dataset), collate_fn=collate_pairs)
 
     keyphrases_selection(doc_list, labels_stemed, labels, model, dataloader, log)
     end = time.time()
@@ -0,0 +1,221 @@
+"""
+Servidor local de MDERank con el modelo y spaCy cargados una sola vez.
+
+POST /extract  {"documents": [{"id": "a", "text": "..."}, ...], "k": 10}   (o {"text": "..."})
+  -> {"keyphrases": {"a": [...], ...}}
+GET /health    -> {"status": "ok"}
+
+Las peticiones concurrentes se juntan en micro-lotes (hasta --max_batch_docs documentos o
+--batch_wait segundos) que pasan juntos por spaCy y por el modelo.
+
+MicroBatcher, parse_documents, ExtractHandler y ThreadingUnixHTTPServer estan duplicados en
+attentionrank/server.py: cada subproyecto se construye por separado (su Dockerfile
+copia solo su carpeta), asi que cualquier cambio en esta capa HTTP hay que hacerlo en los dos.
+"""
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import BertForMaskedLM, BertTokenizer, RobertaTokenizer, RobertaForMaskedLM
+
+import mderank_exec
+from CandidatesGenerator import CandidatesGenerator
+from mderank_exec import KPE_Dataset, LengthGroupedSampler, clean_text, collate_pairs, encode_document, \
+    generate_absent_doc, rank_documents
+
+
+class MicroBatcher:
+    """Junta los documentos de peticiones concurrentes y los procesa en un unico hilo"""
+
+    def __init__(self, process_batch, max_docs=32, wait=0.05):
+        self.process_batch = process_batch
+        self.max_docs = max_docs
+        self.wait = wait
+        self.queue = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, documents):
+        """Encola una lista de textos; el Future devuelve la lista de keyphrases de cada uno"""
+        future = Future()
+        self.queue.put((documents, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            n_docs = len(batch[0][0])
+            deadline = time.monotonic() + self.wait
+            while n_docs < self.max_docs:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_docs += len(item[0])
+
+            try:
+                results = self.process_batch([text for documents, _ in batch for text in documents])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for documents, future in batch:
+                future.set_result(results[start:start + len(documents)])
+                start += len(documents)
+
+
+class Extractor:
+    """Modelo, tokenizer y CandidatesGenerator cargados una vez; extrae keyphrases de lotes de textos"""
+
+    def __init__(self, args):
+        self.args = args
+        if args.model_type == 'roberta':
+            tokenizer = RobertaTokenizer.from_pretrained(args.model_name_or_path)
+            self.model = RobertaForMaskedLM.from_pretrained(args.model_name_or_path)
+        else:
+            tokenizer = BertTokenizer.from_pretrained(args.model_name_or_path)
+            self.model = BertForMaskedLM.from_pretrained(args.model_name_or_path)
+        device = torch.device("cuda" if torch.cuda.is_available() and not args.no_cuda else "cpu")
+        self.model.to(device)
+        self.generator = CandidatesGenerator(args.lang)
+
+        # mderank_exec trabaja con globales de modulo, como cuando se ejecuta como script
+        mderank_exec.args = args
+        mderank_exec.tokenizer = tokenizer
+        mderank_exec.model_type = args.model_type
+        mderank_exec.model_name = args.model_name_or_path
+        mderank_exec.lang = args.lang
+        mderank_exec.MAX_LEN = tokenizer.model_max_length
+
+    def __call__(self, texts):
+        texts = [' '.join(clean_text(text.replace("%", ''), database="Semeval2017").lower().split()[:512])
+                 for text in texts]
+        all_cans = self.generator.generate_candidates_batch(texts, 1, self.args.spacy_batch_size)
+        docs_pairs = []
+        for idx, (doc, cans) in enumerate(zip(texts, all_cans)):
+            doc_pairs, count = generate_absent_doc(encode_document(doc), [can.lower() for can, pos in cans], idx)
+            docs_pairs.extend(doc_pairs)
+
+        dataset = KPE_Dataset(docs_pairs)
+        dataloader = DataLoader(dataset, batch_size=self.args.batch_size, sampler=LengthGroupedSampler(dataset),
+                                collate_fn=collate_pairs)
+        results = [[] for _ in texts]
+        for i, candidates in rank_documents(self.model, dataloader, texts, int(self.args.k_value)):
+            results[i] = candidates
+        return results
+
+
+def parse_documents(payload):
+    """Lista de (id, texto) de una peticion {"documents": [...]} o {"text": ...}"""
+    if 'documents' in payload:
+        documents = payload['documents']
+    else:
+        documents = [{'id': payload.get('id', '0'), 'text': payload['text']}]
+    parsed = []
+    for i, document in enumerate(documents):
+        if isinstance(document, str):
+            parsed.append((str(i), document))
+        else:
+            parsed.append((str(document.get('id', i)), document['text']))
+        # un texto que no es str fallaria dentro del micro-lote y tiraria tambien las peticiones vecinas
+        if not isinstance(parsed[-1][1], str):
+            raise TypeError('text of document %s is not a string' % parsed[-1][0])
+    return parsed
+
+
+class ExtractHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # en un socket Unix client_address no es (host, puerto)
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/extract':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            documents = parse_documents(payload)
+            k = int(payload.get('k', self.server.k_value))
+            # los resultados ya vienen cortados a --k_value: un k mayor devolveria menos sin avisar
+            if not 1 <= k <= self.server.k_value:
+                raise ValueError('k must be between 1 and %d' % self.server.k_value)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send_json(400, {'error': 'bad request: %s' % e})
+            return
+
+        try:
+            results = self.server.batcher.submit([text for _, text in documents]).result()
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        self.send_json(200, {'keyphrases': {doc_id: keyphrases[:k]
+                                            for (doc_id, _), keyphrases in zip(documents, results)}})
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_name_or_path", default='bert-uncased', type=str, help="model used")
+    parser.add_argument("--model_type", default='bert', type=str, help="Model type")
+    parser.add_argument("--lang", default='en', type=str, help="language")
+    parser.add_argument("--doc_embed_mode", default="mean", type=str, help="The method for doc embedding.")
+    parser.add_argument("--layer_num", default=-1, type=int, help="The hidden state layer of BERT.")
+    parser.add_argument("--batch_size", default=16, type=int, help="Masked documents per model forward pass")
+    parser.add_argument("--k_value", default='15', type=str, help="K-elements to return")
+    parser.add_argument("--spacy_batch_size", default=64, type=int, help="Documents per spaCy nlp.pipe batch")
+    parser.add_argument("--no_cuda", action="store_true", help="Whether not to use CUDA when available")
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="HTTP host")
+    parser.add_argument("--port", default=8765, type=int, help="HTTP port")
+    parser.add_argument("--socket", default=None, type=str, help="Serve on this Unix socket path instead of TCP")
+    parser.add_argument("--max_batch_docs", default=32, type=int, help="Documents per micro-batch")
+    parser.add_argument("--batch_wait", default=0.05, type=float,
+                        help="Seconds to wait for more concurrent requests before running a micro-batch")
+    return parser
+
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    extractor = Extractor(args)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, ExtractHandler)
+        print("MDERank serving on unix:" + args.socket)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), ExtractHandler)
+        print("MDERank serving on http://%s:%d" % (args.host, args.port))
+    server.batcher = MicroBatcher(extractor, args.max_batch_docs, args.batch_wait)
+    server.k_value = int(args.k_value)
+    server.serve_forever()
@@ -19,6 +19,11 @@ import time
 # nltk.download('averaged_perceptron_tagger')
 from nltk.stem import PorterStemmer
 import itertools
+import sys
+
+# MentionIndex vive junto a los scripts de MDERank
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MDERank'))
+from MentionIndex import MentionIndex
 
 MAX_LEN =512
 
@@ -61,60 +66,21 @@ class KPE_Dataset(Dataset):
         #     for pair in doc_pairs:
         #         pair.append(doc_id)
         #         total_pairs.append(pair)
+        # los pares ya vienen tokenizados por generate_absent_doc
         self.docs_pairs = docs_pairs
         self.total_examples = len(self.docs_pairs)
-        self.tokenizer =  BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
     def __len__(self):
         return self.total_examples
 
     def __getitem__(self, idx):
 
         doc_pair = self.docs_pairs[idx]
-        ori_doc = doc_pair[0]
-        masked_doc = doc_pair[1]
-        candidate = doc_pair[2]
-        doc_id = doc_pair[3]
-
-        tokenized_ori_doc = self.tokenized_doc(ori_doc, self.tokenizer, candidate, mode='ori')
-        tokenized_masked_doc = self.tokenized_doc(masked_doc, self.tokenizer, candidate, mode='mask')
+        tokenized_ori_doc = doc_pair[0]
+        tokenized_masked_doc = doc_pair[1]
+        doc_id = doc_pair[2]
 
         return [tokenized_ori_doc, tokenized_masked_doc, doc_id]
 
-    def tokenized_doc(self, doc, tokenizer, candidate, mode):
-
-        max_len = MAX_LEN
-
-        encoded_dict = tokenizer.encode_plus(
-            doc,  # Sentence to encode.
-            add_special_tokens=True,  # Add '[CLS]' and '[SEP]'
-            max_length=max_len,  # Pad & truncate all sentences.
-            padding='max_length',
-            return_attention_mask=True,  # Construct attn. masks.
-            return_tensors='pt',  # Return pytorch tensors.
-            truncation=True
-        )
-        input_ids = encoded_dict["input_ids"]
-        attention_mask = encoded_dict["attention_mask"]
-        token_type_ids = encoded_dict["token_type_ids"]
-
-        # 保存在字典里
-        if mode == 'mask':
-            example = {
-                "input_ids": input_ids,
-                "token_type_ids": token_type_ids,
-                "attention_mask": attention_mask,
-                "candidate": candidate
-            }
-
-        else:
-            example = {
-                "input_ids": input_ids,
-                "token_type_ids": token_type_ids,
-                "attention_mask": attention_mask,
-                "candidate": candidate
-            }
-
-        return example
 
 def load_dataset(file_path):
     """ Load file.jsonl ."""
@@ -189,21 +155,32 @@ def dedup(candidates):
 
     return  new_can
 
-def generate_absent_doc(doc, candidates, idx):
+def generate_absent_doc(doc, candidates, idx, tokenizer):
 
     doc_pairs = []
+    # el documento se tokeniza una vez; cada candidato enmascara una copia de sus ids
+    ori_encode_dict = tokenizer.encode_plus(
+        doc.lower(),  # Sentence to encode.
+        add_special_tokens=True,  # Add '[CLS]' and '[SEP]'
+        max_length=MAX_LEN,  # Pad & truncate all sentences.
+        padding='max_length',
+        return_attention_mask=True,  # Construct attn. masks.
+        return_tensors='pt',  # Return pytorch tensors.
+        truncation=True
+    )
+    mentions = MentionIndex(ori_encode_dict["input_ids"].squeeze(0).numpy())
+
     #每个文章的candidate， 可能有多个
     doc_candidate = dedup(candidates)
     for id, candidate in enumerate(doc_candidate.keys()):
-        candidate_len = doc_candidate[candidate]
-        mask = ' '.join(['[MASK]']*candidate_len)
-        try:
-            candidate_re = re.compile(r"\b" + candidate + r"\b")
-            masked_doc = re.sub(candidate_re, mask, doc.lower())
-        except:
-            continue
-
-        doc_pairs.append([doc.lower(), masked_doc, candidate, idx])
+        candidate_ids = tokenizer.encode(candidate, add_special_tokens=False)
+        match = mentions.find(candidate_ids)
+        masked_input_ids = mentions.masked(match, len(candidate_ids), tokenizer.mask_token_id)
+
+        ori_example = dict(ori_encode_dict, candidate=candidate)
+        masked_example = dict(ori_encode_dict, candidate=candidate,
+                              input_ids=torch.from_numpy(masked_input_ids).unsqueeze(0))
+        doc_pairs.append([ori_example, masked_example, idx])
         # print("Candidate: ", candidate)
         # print("Masked Doc {} : {}".format(idx, masked_doc))
         # print("Ori_doc {}: {}".format(idx, doc.lower()))
@@ -385,6 +362,7 @@ if __name__ == '__main__':
 
     doc_list, references, doc_avg_tok_num =  generate_doc(args.dataset_dir, args.dataset_name)
 
+    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
     docs_pairs = []
     for idx, doc in tqdm(enumerate(doc_list),desc="generating pairs..."):
         # candidates, candidates_num = extract_candidate_words(doc)
@@ -396,7 +374,7 @@ if __name__ == '__main__':
         candidates = list(extractor.candidates.keys())
 
         candidates_num = len(candidates)
-        doc_pairs = generate_absent_doc(doc, candidates, idx)
+        doc_pairs = generate_absent_doc(doc, candidates, idx, tokenizer)
         docs_pairs.extend(doc_pairs)
 
     dataset = KPE_Dataset(docs_pairs)
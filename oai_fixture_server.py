@@ -0,0 +1,220 @@
+# oai_fixture_server.py
+"""
+Servidor OAI-PMH local que sustituye a www.econstor.eu para medir y probar harvest_econstor.py
+sin red. Sirve Identify y ListRecords (oai_dc, from/until, resumptionToken) con registros
+sintéticos o reconstruidos a partir de un JSONL ya cosechado (doc_id, text, keywords).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+OAI_PATH = "/oai/request"
+_re_invalid_xml = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# --- Registros ---
+_TOPICS = ["monetary policy", "financial crisis", "labour market", "asset pricing", "risk management",
+           "income inequality", "economic growth", "trade policy", "central bank", "credit risk",
+           "housing market", "public debt", "exchange rate", "interest rates", "climate policy"]
+_FILLER = ["We study", "This paper analyses", "Using panel data, we estimate", "We show that",
+           "Our results suggest that", "The evidence indicates that", "We document how"]
+
+def synthetic_records(n: int, seed: int = 0) -> List[Dict]:
+    """
+    Registros sintéticos con la mezcla de casos que filtra el harvester: sin título, en alemán,
+    texto corto, subjects de una palabra y keywords que no aparecen en el texto.
+    """
+    rnd = random.Random(seed)
+    records = []
+    for i in range(n):
+        topics = rnd.sample(_TOPICS, 4)
+        title = f"{topics[0].capitalize()} and {topics[1]}: evidence from sample {i}"
+        sentences = [f"{rnd.choice(_FILLER)} the role of {rnd.choice(topics[:3])} in {rnd.choice(_TOPICS)}."
+                     for _ in range(rnd.randint(1, 8))]
+        rec = {"id": f"oai:fixture:{i}", "title": title, "abstract": " ".join(sentences),
+               "subjects": topics + [rnd.choice(["Finance", "G21", "E52"])], "language": "eng"}
+        kind = rnd.random()
+        if kind < 0.03:
+            rec["title"] = None
+        elif kind < 0.10:
+            rec["language"] = "ger"
+        elif kind < 0.20:
+            rec["abstract"] = None
+        elif kind < 0.26:
+            rec["subjects"] = ["Währungspolitik", "Zinsänderungsrisiko"]
+        elif kind < 0.32:
+            rec["subjects"] = ["behavioural finance", "market microstructure"]
+        records.append(rec)
+    return records
+
+def jsonl_records(path: str) -> List[Dict]:
+    """Registros a partir de un JSONL del harvester: el texto es "título — resumen"."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            doc = json.loads(line)
+            title, _, abstract = doc["text"].partition(" — ")
+            records.append({"id": doc["doc_id"], "title": title, "abstract": abstract or None,
+                            "subjects": doc.get("keywords", []), "language": "eng"})
+    return records
+
+def assign_datestamps(records: List[Dict], start: str = "2015-01-01", per_day: int = 5):
+    """Fechas crecientes (per_day registros por día) para poder cosechar por ventanas."""
+    first = date.fromisoformat(start)
+    for i, rec in enumerate(records):
+        rec["datestamp"] = (first + timedelta(days=i // per_day)).isoformat()
+    return records
+
+def _xml_text(value: str) -> str:
+    return escape(_re_invalid_xml.sub("", value))
+
+def record_xml(rec: Dict) -> str:
+    parts = []
+    if rec.get("title"):
+        parts.append(f"<dc:title>{_xml_text(rec['title'])}</dc:title>")
+    if rec.get("abstract"):
+        parts.append(f'<dc:description xml:lang="en">{_xml_text(rec["abstract"])}</dc:description>')
+    parts.extend(f"<dc:subject>{_xml_text(s)}</dc:subject>" for s in rec.get("subjects", []))
+    if rec.get("language"):
+        parts.append(f"<dc:language>{rec['language']}</dc:language>")
+    return (f"<record><header><identifier>{_xml_text(rec['id'])}</identifier>"
+            f"<datestamp>{rec['datestamp']}</datestamp></header><metadata>"
+            f'<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+            f'xmlns:dc="http://purl.org/dc/elements/1.1/">{"".join(parts)}</oai_dc:dc>'
+            f"</metadata></record>")
+
+# --- Respuestas OAI-PMH ---
+def oai_response(body: str) -> bytes:
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">'
+            f"<responseDate>{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}</responseDate>"
+            f"{body}</OAI-PMH>").encode("utf-8")
+
+def oai_error(code: str, message: str) -> bytes:
+    return oai_response(f'<error code="{code}">{escape(message)}</error>')
+
+class FixtureRepository:
+    """Registros ordenados por fecha, paginados como ListRecords."""
+    def __init__(self, records: List[Dict], page_size: int = 100):
+        self.records = sorted(records, key=lambda r: r["datestamp"])
+        self.page_size = page_size
+
+    def identify(self) -> bytes:
+        earliest = self.records[0]["datestamp"] if self.records else date.today().isoformat()
+        return oai_response("<Identify><repositoryName>OAI fixture</repositoryName>"
+                            f"<earliestDatestamp>{earliest}T00:00:00Z</earliestDatestamp>"
+                            "<granularity>YYYY-MM-DDThh:mm:ssZ</granularity></Identify>")
+
+    def list_records(self, params: Dict[str, str]) -> bytes:
+        if "resumptionToken" in params:
+            try:
+                from_date, until_date, offset = params["resumptionToken"].split("|")
+                offset = int(offset)
+            except ValueError:
+                return oai_error("badResumptionToken", params["resumptionToken"])
+        else:
+            if params.get("metadataPrefix") != "oai_dc":
+                return oai_error("cannotDisseminateFormat", params.get("metadataPrefix", ""))
+            from_date, until_date, offset = params.get("from", ""), params.get("until", ""), 0
+
+        selected = [r for r in self.records
+                    if (not from_date or r["datestamp"] >= from_date[:10])
+                    and (not until_date or r["datestamp"] <= until_date[:10])]
+        if not selected:
+            return oai_error("noRecordsMatch", "No records")
+
+        page = selected[offset:offset + self.page_size]
+        end = offset + len(page)
+        if end < len(selected):
+            token = (f'<resumptionToken completeListSize="{len(selected)}" cursor="{offset}">'
+                     f"{from_date}|{until_date}|{end}</resumptionToken>")
+        else:
+            token = f'<resumptionToken completeListSize="{len(selected)}" cursor="{offset}"/>'
+        return oai_response("<ListRecords>" + "".join(record_xml(r) for r in page) + token + "</ListRecords>")
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    # keep-alive, para que la reutilización de conexiones del harvester cuente
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != OAI_PATH:
+            self.send_body(404, b"")
+            return
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            n = server.requests
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_every and n % server.fail_every == 0:
+            self.send_body(503, b"", {"Retry-After": "0"})
+            return
+
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        verb = params.get("verb")
+        if verb == "Identify":
+            self.send_body(200, server.repository.identify())
+        elif verb == "ListRecords":
+            self.send_body(200, server.repository.list_records(params))
+        else:
+            self.send_body(200, oai_error("badVerb", verb or ""))
+
+def start_fixture_server(records: List[Dict], page_size: int = 100, latency: float = 0.0, fail_every: int = 0,
+                         host: str = "127.0.0.1", port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Arranca el servidor en un hilo y devuelve (servidor, URL base OAI). port=0 elige uno libre."""
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    server.repository = FixtureRepository(records, page_size)
+    server.latency = latency
+    server.fail_every = fail_every
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{OAI_PATH}"
+
+def load_fixture_records(jsonl: Optional[str] = None, synthetic: int = 2000, seed: int = 0) -> List[Dict]:
+    records = jsonl_records(jsonl) if jsonl else synthetic_records(synthetic, seed)
+    return assign_datestamps(records)
+
+def main():
+    ap = argparse.ArgumentParser("Servidor OAI-PMH local para probar y medir harvest_econstor.py")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--jsonl", default=None, help="JSONL cosechado (doc_id, text, keywords) a servir como registros")
+    ap.add_argument("--synthetic", type=int, default=2000, help="Registros sintéticos si no se da --jsonl")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--page-size", type=int, default=100, help="Registros por página de ListRecords")
+    ap.add_argument("--latency", type=float, default=0.0, help="Retardo en segundos por petición")
+    ap.add_argument("--fail-every", type=int, default=0, help="Responder 503 a una de cada N peticiones")
+    args = ap.parse_args()
+
+    records = load_fixture_records(args.jsonl, args.synthetic, args.seed)
+    server, url = start_fixture_server(records, args.page_size, args.latency, args.fail_every, args.host, args.port)
+    print(f"Sirviendo {len(records)} registros en {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
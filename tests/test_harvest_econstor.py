@@ -0,0 +1,45 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harvest_econstor
+from oai_fixture_server import load_fixture_records, start_fixture_server
+
+
+@pytest.fixture
+def fixture_server(monkeypatch):
+    server, url = start_fixture_server(load_fixture_records(synthetic=2000), page_size=5)
+    monkeypatch.setattr(harvest_econstor, "OAI_BASE", url)
+    yield server
+    server.shutdown()
+
+
+def test_windows_writer_error_does_not_deadlock(fixture_server, monkeypatch, tmp_path):
+    # el escritor falla en el quinto registro con la cola ya llena de páginas de los cursores
+    filter_record = harvest_econstor.filter_record
+    calls = []
+    def failing_filter(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 5:
+            raise RuntimeError("writer failed")
+        return filter_record(*args, **kwargs)
+    monkeypatch.setattr(harvest_econstor, "filter_record", failing_filter)
+
+    errors = []
+    def run():
+        try:
+            harvest_econstor.harvest_econstor_windows(str(tmp_path / "out.jsonl"), from_date="2015-01-01",
+                                                      until_date="2016-02-01", window_days=10, workers=2,
+                                                      rate=1000, max_records=10**6)
+        except BaseException as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=30)
+    assert not thread.is_alive(), "harvest_econstor_windows se ha quedado bloqueado"
+    assert len(errors) == 1 and str(errors[0]) == "writer failed"